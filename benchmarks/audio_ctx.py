@@ -0,0 +1,80 @@
+"""
+Compare the latency and the transcriptions of short clips padded to 30 seconds, as by default,
+and encoded with an audio context matching their length, with `dynamic_audio_ctx=True`
+
+    python benchmarks/audio_ctx.py --model base --audio tests/jfk.flac --seconds 1 2 5 10
+"""
+
+import argparse
+import time
+
+import torch
+from quantization import word_errors
+
+import whisper
+from whisper.audio import N_FRAMES, SAMPLE_RATE, load_audio
+from whisper.normalizers import EnglishTextNormalizer
+
+
+def encoder_latency(model, n_frames: int, repeat: int = 3) -> float:
+    mel = torch.randn(1, model.dims.n_mels, n_frames, device=model.device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.embed_audio(mel)
+        if model.device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="base", help="name or path of the Whisper model to use")
+    parser.add_argument("--device", default="cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--audio", default="tests/jfk.flac", help="recording to cut the clips from")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1, 2, 3, 5, 10], help="lengths of the clips")
+    parser.add_argument("--language", default="en", help="language of the recording")
+    # fmt: on
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device=args.device)
+    audio = load_audio(args.audio)
+    normalizer = EnglishTextNormalizer()
+    options = dict(language=args.language, fp16=False, temperature=0)
+
+    with torch.no_grad():
+        full = encoder_latency(model, N_FRAMES)
+    print(f"encoder with the 30-second context: {full * 1000:.0f} ms")
+    print(f"{'clip':>6}{'encoder':>10}{'padded':>10}{'dynamic':>10}{'WER':>8}")
+
+    errors, words = 0, 0
+    for seconds in args.seconds:
+        clip = audio[: int(seconds * SAMPLE_RATE)]
+        n_frames = 2 * -(-int(seconds * 100) // 100) * 50  # rounded up to whole seconds
+        with torch.no_grad():
+            encoder = encoder_latency(model, n_frames)
+
+        elapsed, texts = [], []
+        for dynamic_audio_ctx in [False, True]:
+            start = time.perf_counter()
+            result = model.transcribe(
+                clip, dynamic_audio_ctx=dynamic_audio_ctx, **options
+            )
+            elapsed.append(time.perf_counter() - start)
+            texts.append(normalizer(result["text"]))
+
+        # the padded transcription is the reference
+        e, n = word_errors(*texts)
+        errors, words = errors + e, words + n
+        print(
+            f"{seconds:>5}s{encoder * 1000:>7.0f} ms{elapsed[0]:>8.2f} s{elapsed[1]:>8.2f} s"
+            f"{e / max(n, 1):>8.1%}  {texts[1]}"
+        )
+
+    print(f"WER against the padded transcriptions: {errors / max(words, 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the per-file decoding latency of the `load_audio()` backends
+
+    python benchmarks/audio_decoding.py [AUDIO_FILE] --repeat 20
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from whisper.audio import AUDIO_DECODERS, SAMPLE_RATE, load_audio, soundfile
+
+
+def write_test_files(audio: np.ndarray, directory: str):
+    """Write the waveform in each of the formats that the in-process decoders support"""
+    pcm = (audio * 32768).clip(-32768, 32767).astype("<i2")
+    files = []
+
+    with wave.open(path := os.path.join(directory, "audio.wav"), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    files.append(path)
+
+    pcm.tofile(path := os.path.join(directory, "audio.pcm"))
+    files.append(path)
+
+    if soundfile is not None:
+        for extension in ["flac", "ogg"]:
+            path = os.path.join(directory, f"audio.{extension}")
+            soundfile.write(path, pcm, SAMPLE_RATE)
+            files.append(path)
+
+    return files
+
+
+def benchmark(file: str, backend: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_audio(file, backend=backend)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+    default = os.path.join(os.path.dirname(__file__), "..", "tests", "jfk.flac")
+
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("audio", nargs="?", default=default, help="source audio, converted to each of the tested formats")
+    parser.add_argument("--repeat", type=int, default=20, help="number of times to decode each file")
+    # fmt: on
+    args = parser.parse_args()
+
+    audio = load_audio(args.audio, backend="ffmpeg")
+    print(f"{len(audio) / SAMPLE_RATE:.1f} seconds of audio")
+    print(f"{'file':<12}{'backend':<12}{'median latency':>16}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for file in write_test_files(audio, directory):
+            for backend, decoder in AUDIO_DECODERS.items():
+                try:
+                    if decoder(file, SAMPLE_RATE) is None:
+                        continue  # unsupported by this in-process decoder
+                except RuntimeError:
+                    continue  # unsupported by ffmpeg, e.g. headerless PCM
+                latency = benchmark(file, backend, args.repeat)
+                name = os.path.basename(file)
+                print(f"{name:<12}{backend:<12}{latency * 1000:>13.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure the peak memory of loading an audio file and computing its padded log-Mel spectrogram,
+as `transcribe()` does before decoding the first window
+
+    python benchmarks/audio_ingest.py AUDIO_FILE --backend ffmpeg
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from whisper.audio import AUDIO_DECODERS, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram
+
+
+def peak_rss() -> int:
+    """The peak resident set size of this process, in bytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def ingest(file: str, backend: str, queue: multiprocessing.Queue):
+    # let `log_mel_spectrogram()` load the file with the requested decoder only
+    decoder = AUDIO_DECODERS[backend]
+    AUDIO_DECODERS.clear()
+    AUDIO_DECODERS[backend] = decoder
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    mel = log_mel_spectrogram(file, 80, padding=N_SAMPLES)
+    elapsed = time.perf_counter() - start
+    queue.put((mel.shape[-1], baseline, peak_rss(), elapsed))
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("audio", help="audio file to load, e.g. an hour-long recording")
+    parser.add_argument("--backend", choices=list(AUDIO_DECODERS), default="ffmpeg", help="the decoder to load the audio with")
+    # fmt: on
+    args = parser.parse_args()
+
+    # a fresh process, so that the peak is not affected by earlier allocations
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=ingest, args=(args.audio, args.backend, queue))
+    process.start()
+    num_frames, baseline, peak, elapsed = queue.get()
+    process.join()
+
+    seconds = num_frames / (SAMPLE_RATE / 160)
+    print(f"{seconds / 60:.1f} minutes of audio (including padding), {elapsed:.1f} s")
+    print(
+        f"peak RSS: {peak / 2**20:.0f} MiB ({(peak - baseline) / 2**20:.0f} MiB above baseline)"
+    )
+
+
+if __name__ == "__main__":
+    main()
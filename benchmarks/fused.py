@@ -0,0 +1,95 @@
+"""
+Compare the encoder latency and the per-step decoder latency of the model with separate query,
+key, value and MLP projections, and with them fused by `load_model(..., fused=True)`
+
+    python benchmarks/fused.py --models tiny base small --beam_size 5
+    python benchmarks/fused.py --models tiny base --random_weights  # no download
+"""
+
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+from quantization import random_model
+
+import whisper
+from whisper.audio import N_FRAMES
+from whisper.decoding import PyTorchInference
+from whisper.model import fuse_projections
+
+
+def encoder_latency(model, mel: torch.Tensor, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.embed_audio(mel)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def decoder_latency(model, audio_features, beam_size: int, n_tokens: int) -> float:
+    initial_tokens = [50258, 50259, 50359]  # <|startoftranscript|><|en|><|transcribe|>
+    tokens = torch.tensor([initial_tokens] * beam_size)
+    inference = PyTorchInference(
+        model, len(initial_tokens), len(initial_tokens) + n_tokens
+    )
+
+    times = []
+    try:
+        for _ in range(n_tokens):
+            start = time.perf_counter()
+            logits = inference.logits(tokens, audio_features)
+            times.append(time.perf_counter() - start)
+            next_tokens = logits[:, -1].argmax(dim=-1, keepdim=True)
+            tokens = torch.cat([tokens, next_tokens], dim=-1)
+    finally:
+        inference.cleanup_caching()
+
+    return np.median(times[1:])  # excluding the forward pass over the initial tokens
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["tiny", "base"], help="names or paths of the Whisper models to compare")
+    parser.add_argument("--random_weights", action="store_true", help="use random weights with the dimensions of the official models")
+    parser.add_argument("--beam_size", type=int, default=5, help="number of beams decoded at each step")
+    parser.add_argument("--tokens", type=int, default=100, help="number of tokens to decode")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times to run each measurement, alternating the variants")
+    parser.add_argument("--threads", type=int, default=0, help="number of threads used by torch for CPU inference")
+    # fmt: on
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    print(f"{'model':<10}{'variant':<10}{'encoder':>12}{'decoder':>16}")
+    for name in args.models:
+        if args.random_weights:
+            model = random_model(name)
+        else:
+            model = whisper.load_model(name, device="cpu")
+        variants = {"separate": model, "fused": fuse_projections(copy.deepcopy(model))}
+
+        mel = torch.randn(1, model.dims.n_mels, N_FRAMES)
+        encoder = {variant: [] for variant in variants}
+        decoder = {variant: [] for variant in variants}
+        with torch.no_grad():
+            audio_features = model.embed_audio(mel)
+            for _ in range(args.repeat):
+                for variant, m in variants.items():
+                    encoder[variant].append(encoder_latency(m, mel, 1))
+                    decoder[variant].append(
+                        decoder_latency(m, audio_features, args.beam_size, args.tokens)
+                    )
+
+        for variant in variants:
+            print(
+                f"{name:<10}{variant:<10}{min(encoder[variant]) * 1000:>9.0f} ms"
+                f"{np.median(decoder[variant]) * 1000:>9.2f} ms/step"
+            )
+
+
+if __name__ == "__main__":
+    main()
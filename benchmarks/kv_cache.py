@@ -0,0 +1,66 @@
+"""
+Compare the per-token latency of the decoder with the kv cache concatenated at every step and
+with the static kv cache, for a beam search that reorders the beams at every step
+
+    python benchmarks/kv_cache.py --model base --beam_size 5 --tokens 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import whisper
+from whisper.decoding import PyTorchInference
+
+
+def benchmark(model, audio_features, beam_size: int, n_tokens: int, static: bool):
+    rng = np.random.default_rng(0)
+    initial_tokens = [50258, 50259, 50359]  # <|startoftranscript|><|en|><|transcribe|>
+    tokens = torch.tensor([initial_tokens] * beam_size, device=model.device)
+    max_length = len(initial_tokens) + n_tokens if static else None
+    inference = PyTorchInference(model, len(initial_tokens), max_length)
+
+    times = []
+    try:
+        for _ in range(n_tokens):
+            start = time.perf_counter()
+            logits = inference.logits(tokens, audio_features)
+            source_indices = sorted(rng.integers(0, beam_size, beam_size).tolist())
+            inference.rearrange_kv_cache(source_indices)
+            next_tokens = logits[:, -1].argmax(dim=-1, keepdim=True)
+            tokens = torch.cat([tokens[source_indices], next_tokens], dim=-1)
+            if model.device.type == "cuda":
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+    finally:
+        inference.cleanup_caching()
+
+    return np.mean(times[1:])  # excluding the forward pass over the initial tokens
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="base", help="name or path of the Whisper model to use")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--beam_size", type=int, default=5, help="number of beams")
+    parser.add_argument("--tokens", type=int, default=200, help="number of tokens to decode")
+    # fmt: on
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device=args.device)
+    mel = torch.randn(1, model.dims.n_mels, whisper.audio.N_FRAMES, device=model.device)
+    with torch.no_grad():
+        audio_features = model.embed_audio(mel)
+        for static in [False, True]:
+            latency = benchmark(
+                model, audio_features, args.beam_size, args.tokens, static
+            )
+            name = "static" if static else "torch.cat"
+            print(f"{name:<12}{latency * 1000:8.2f} ms/token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare the throughput of the sequential transcription of a long recording, seeking from one
+window to the next, with the windows placed at a fixed hop and decoded in batches
+
+    python benchmarks/long_form.py --model base --minutes 10 --batch_sizes 1 4 8 16
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from quantization import word_errors
+
+import whisper
+from whisper.audio import SAMPLE_RATE, load_audio
+from whisper.normalizers import EnglishTextNormalizer
+
+
+def long_recording(audio: np.ndarray, minutes: float) -> np.ndarray:
+    """The recording repeated with a second of silence in between, for the given duration"""
+    silence = np.zeros(SAMPLE_RATE, dtype=audio.dtype)
+    n_samples = int(minutes * 60 * SAMPLE_RATE)
+    n_repeats = -(-n_samples // (len(audio) + len(silence)))
+    return np.tile(np.concatenate([audio, silence]), n_repeats)[:n_samples]
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="base", help="name or path of the Whisper model to use")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--audio", default="tests/jfk.flac", help="recording to repeat into the long recording")
+    parser.add_argument("--minutes", type=float, default=5, help="duration of the long recording")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="numbers of windows to decode at a time")
+    parser.add_argument("--window_overlap", type=float, default=5.0, help="overlap of consecutive windows in seconds")
+    parser.add_argument("--language", default="en", help="language of the recording")
+    # fmt: on
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device=args.device)
+    audio = long_recording(load_audio(args.audio), args.minutes)
+    duration = len(audio) / SAMPLE_RATE
+    normalizer = EnglishTextNormalizer()
+    options = dict(
+        language=args.language,
+        fp16=model.device.type == "cuda",
+        temperature=(0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        condition_on_previous_text=False,
+        count_encoder_calls=True,
+    )
+
+    start = time.perf_counter()
+    result = model.transcribe(audio, **options)
+    elapsed = time.perf_counter() - start
+    reference = normalizer(result["text"])
+    print(f"{'batch':>8}{'windows':>9}{'time':>10}{'speed':>9}{'WER':>8}")
+    print(
+        f"{'seq':>8}{len(result['encoder_calls']):>9}{elapsed:>8.2f} s"
+        f"{duration / elapsed:>8.1f}x{0:>8.1%}"
+    )
+
+    # the sequential transcription is the reference
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        result = model.transcribe(
+            audio,
+            batch_size=batch_size,
+            window_overlap=args.window_overlap,
+            **options,
+        )
+        elapsed = time.perf_counter() - start
+        errors, words = word_errors(reference, normalizer(result["text"]))
+        print(
+            f"{batch_size:>8}{len(result['encoder_calls']):>9}{elapsed:>8.2f} s"
+            f"{duration / elapsed:>8.1f}x{errors / max(words, 1):>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
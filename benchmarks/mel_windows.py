@@ -0,0 +1,90 @@
+"""
+Count the tensor allocations and the time spent preparing the encoder input windows in the
+`transcribe()` seek loop, with `pad_or_trim()` and `.to()` versus a `MelWindowPool`
+
+    python benchmarks/mel_windows.py --minutes 180 --device cuda --dtype float16
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from whisper.audio import (
+    N_FRAMES,
+    N_SAMPLES,
+    SAMPLE_RATE,
+    MelWindowPool,
+    log_mel_spectrogram,
+    pad_or_trim,
+)
+
+
+def seek_segments(content_frames: int, seed: int = 0):
+    """Simulate the seek loop, which often advances by less than a window"""
+    rng = np.random.default_rng(seed)
+    seek = 0
+    while seek < content_frames:
+        segment_size = min(N_FRAMES, content_frames - seek)
+        yield seek, segment_size
+        seek += min(segment_size, int(rng.integers(N_FRAMES // 2, N_FRAMES + 1)))
+
+
+def count_allocations(run, device: torch.device):
+    """Run the function and return the number of tensor allocations, and the elapsed time"""
+    activities = [ProfilerActivity.CPU]
+    if device.type == "cuda":
+        activities.append(ProfilerActivity.CUDA)
+    with profile(activities=activities, profile_memory=True) as prof:
+        start = time.perf_counter()
+        run()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+
+    allocations = sum(
+        event.self_cpu_memory_usage > 0
+        or getattr(event, "self_device_memory_usage", 0) > 0
+        for event in prof.events()
+    )
+    return allocations, elapsed
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60, help="length of the simulated audio")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device of the windows")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16", help="dtype of the windows")
+    # fmt: on
+    args = parser.parse_args()
+    device, dtype = torch.device(args.device), getattr(torch, args.dtype)
+
+    audio = np.random.default_rng(0).standard_normal(
+        int(args.minutes * 60 * SAMPLE_RATE), dtype=np.float32
+    )
+    mel = log_mel_spectrogram(audio, padding=N_SAMPLES)
+    segments = list(seek_segments(mel.shape[-1] - N_FRAMES))
+
+    def allocating():
+        for seek, segment_size in segments:
+            segment = mel[:, seek : seek + segment_size]
+            pad_or_trim(segment, N_FRAMES).to(device).to(dtype)
+
+    pool = MelWindowPool(mel.shape[0], N_FRAMES, device, dtype)
+
+    def pooled():
+        for seek, segment_size in segments:
+            pool.fill(mel[:, seek : seek + segment_size])
+
+    print(f"{len(segments)} windows on {device} in {dtype}")
+    print(f"{'method':<16}{'allocations':>12}{'time':>12}")
+    for name, run in [("pad_or_trim", allocating), ("MelWindowPool", pooled)]:
+        allocations, elapsed = count_allocations(run, device)
+        print(f"{name:<16}{allocations:>12}{elapsed * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
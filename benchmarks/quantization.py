@@ -0,0 +1,168 @@
+"""
+Compare the memory, the latency and the word error rate of the models in float32 and with their
+linear layers quantized to int8 on CPU, on `tests/jfk.flac` and a synthetic corpus derived from it
+
+    python benchmarks/quantization.py --models tiny base small
+    python benchmarks/quantization.py --models tiny base --random_weights  # no WER, no download
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+import whisper
+from whisper.audio import N_FRAMES, SAMPLE_RATE, load_audio, resample
+from whisper.decoding import PyTorchInference
+from whisper.model import ModelDimensions, QuantizedLinear, Whisper, quantize_int8
+from whisper.normalizers import EnglishTextNormalizer
+
+JFK_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "jfk.flac")
+JFK_TEXT = "And so my fellow Americans, ask not what your country can do for you, ask what you can do for your country."  # noqa: E501
+
+# the dimensions of the official checkpoints: (n_state, n_head, n_layer)
+MODEL_DIMS = {
+    "tiny": (384, 6, 4),
+    "base": (512, 8, 6),
+    "small": (768, 12, 12),
+    "medium": (1024, 16, 24),
+    "large": (1280, 20, 32),
+}
+
+
+def random_model(name: str) -> Whisper:
+    n_state, n_head, n_layer = MODEL_DIMS[name]
+    dims = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=n_state,
+        n_audio_head=n_head,
+        n_audio_layer=n_layer,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=n_state,
+        n_text_head=n_head,
+        n_text_layer=n_layer,
+    )
+    model = Whisper(dims)
+    generator = torch.Generator().manual_seed(0)
+    for param in model.parameters():
+        if param.ndim > 1:
+            param.data.normal_(std=0.02, generator=generator)
+    return model.eval()
+
+
+def model_bytes(model: Whisper) -> int:
+    """The memory taken by the parameters, the buffers and the packed int8 weights"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    total = sum(t.numel() * t.element_size() for t in tensors)
+    for module in model.modules():
+        if isinstance(module, QuantizedLinear):
+            total += module.in_features * module.out_features + 4 * module.out_features
+    return total
+
+
+def latency(model: Whisper, n_tokens: int = 100, repeat: int = 3):
+    """The time to encode a 30-second window, and the per-token time of greedy decoding"""
+    mel = torch.randn(1, model.dims.n_mels, N_FRAMES)
+    initial_tokens = [50258, 50259, 50359]  # <|startoftranscript|><|en|><|transcribe|>
+
+    encoder_times, decoder_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        audio_features = model.embed_audio(mel)
+        encoder_times.append(time.perf_counter() - start)
+
+        tokens = torch.tensor([initial_tokens])
+        inference = PyTorchInference(
+            model, len(initial_tokens), len(initial_tokens) + n_tokens
+        )
+        try:
+            inference.logits(tokens, audio_features)
+            start = time.perf_counter()
+            for _ in range(n_tokens - 1):
+                logits = inference.logits(tokens, audio_features)
+                tokens = torch.cat([tokens, logits[:, -1:].argmax(dim=-1)], dim=-1)
+            decoder_times.append((time.perf_counter() - start) / (n_tokens - 1))
+        finally:
+            inference.cleanup_caching()
+
+    return min(encoder_times), min(decoder_times)
+
+
+def synthetic_corpus(audio: np.ndarray):
+    """Variations of the recording with added noise, changed tempo, and concatenation"""
+    rng = np.random.default_rng(0)
+    power = np.mean(audio**2)
+    yield "clean", audio, JFK_TEXT
+    for snr in [20, 10]:
+        noise = rng.standard_normal(len(audio)).astype(np.float32)
+        noisy = audio + noise * np.sqrt(power / 10 ** (snr / 10))
+        yield f"noise {snr} dB", noisy, JFK_TEXT
+    for tempo in [0.9, 1.1]:
+        # resampling and playing at the original rate changes the tempo and the pitch
+        yield f"tempo x{tempo}", resample(audio, int(SAMPLE_RATE * tempo)), JFK_TEXT
+    yield "repeated", np.concatenate([audio, audio]), JFK_TEXT + " " + JFK_TEXT
+
+
+def word_errors(reference: str, hypothesis: str):
+    """The word-level Levenshtein distance, and the number of reference words"""
+    ref, hyp = reference.split(), hypothesis.split()
+    distances = np.arange(len(hyp) + 1)
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances.copy(), i
+        for j, hyp_word in enumerate(hyp, 1):
+            substitution = previous[j - 1] + (ref_word != hyp_word)
+            distances[j] = min(substitution, previous[j] + 1, distances[j - 1] + 1)
+    return int(distances[-1]), len(ref)
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["tiny", "base"], help="names or paths of the Whisper models to compare")
+    parser.add_argument("--random_weights", action="store_true", help="use random weights with the dimensions of the official models, for memory and latency only")
+    parser.add_argument("--tokens", type=int, default=100, help="number of tokens to decode for measuring the latency")
+    parser.add_argument("--threads", type=int, default=0, help="number of threads used by torch for CPU inference")
+    # fmt: on
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    normalizer = EnglishTextNormalizer()
+    corpus = list(synthetic_corpus(load_audio(JFK_PATH)))
+
+    header = f"{'model':<10}{'weights':<10}{'memory':>12}{'encoder':>12}{'decoder':>14}"
+    print(header + ("" if args.random_weights else f"{'WER':>8}"))
+    for name in args.models:
+        for quantize in [None, "int8"]:
+            if args.random_weights:
+                model = random_model(name)
+                if quantize:
+                    quantize_int8(model)
+            else:
+                model = whisper.load_model(name, device="cpu", quantize=quantize)
+
+            with torch.no_grad():
+                encoder, decoder = latency(model, args.tokens)
+            label = os.path.splitext(os.path.basename(name))[0]
+            row = f"{label:<10}{quantize or 'float32':<10}{model_bytes(model) / 2**20:>8.0f} MiB"
+            row += f"{encoder * 1000:>9.0f} ms{decoder * 1000:>8.1f} ms/tok"
+
+            if not args.random_weights:
+                errors, words = 0, 0
+                for variant, audio, reference in corpus:
+                    result = model.transcribe(audio, language="en", fp16=False)
+                    e, n = word_errors(
+                        normalizer(reference), normalizer(result["text"])
+                    )
+                    errors, words = errors + e, words + n
+                    print(f"  {variant:<14}{e / n:6.1%}  {result['text'].strip()}")
+                row += f"{errors / words:>8.1%}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,10 @@ from tkinter import ttk, scrolledtext
 import sounddevice as sd
 
 class AudioRecorder:
-    def __init__(self, sample_rate=16000, chunk_size=1024):
+    def __init__(self, sample_rate=None, chunk_size=1024):
+        if sample_rate is None:
+            # record at the device's native rate, the audio is resampled to 16 kHz in-process
+            sample_rate = int(sd.query_devices(kind='input')['default_samplerate'])
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
         self.audio_queue = queue.Queue()
@@ -68,17 +71,19 @@ class WhisperTranscriber:
         self.model_name = model_name
         self.model = None
         self.is_loaded = False
+        self.frontend = None
+        self.mel_buffer = None
         
     def load_model(self):
         if not self.is_loaded:
             self.model = whisper.load_model(self.model_name)
             self.is_loaded = True
             
-    def transcribe_audio(self, audio_data, language=None):
+    def transcribe_audio(self, audio_data, sample_rate=16000, language=None):
         if not self.is_loaded:
             self.load_model()
             
-        audio = whisper.pad_or_trim(audio_data)
+        audio = whisper.pad_or_trim(whisper.audio.resample(audio_data, sample_rate))
         
         mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
         
@@ -89,6 +94,34 @@ class WhisperTranscriber:
         
         result = whisper.decode(self.model, mel, options)
         return result.text
+    
+    def reset_stream(self):
+        self.frontend = None
+        self.mel_buffer = None
+    
+    def transcribe_stream(self, audio_data, buffer_duration=3, language=None, sample_rate=16000):
+        if not self.is_loaded:
+            self.load_model()
+        
+        if self.frontend is None:
+            n_mels = self.model.dims.n_mels
+            self.frontend = whisper.audio.StreamingMelFrontend(n_mels=n_mels, sample_rate=sample_rate)
+            self.mel_buffer = torch.zeros(n_mels, 0)
+        
+        # only the frames of the newly recorded samples are computed
+        new_frames = self.frontend.push(audio_data)
+        buffer_frames = buffer_duration * whisper.audio.FRAMES_PER_SECOND
+        self.mel_buffer = torch.cat([self.mel_buffer, new_frames], dim=1)[:, -buffer_frames:]
+        
+        mel = whisper.pad_or_trim(self.mel_buffer, whisper.audio.N_FRAMES).to(self.model.device)
+        
+        options = whisper.DecodingOptions(
+            language=language if language else None,
+            fp16=torch.cuda.is_available()
+        )
+        
+        result = whisper.decode(self.model, mel, options)
+        return result.text
 
 class SpeechToTextApp:
     def __init__(self, root):
@@ -201,6 +234,8 @@ class SpeechToTextApp:
         self.record_button.config(text="Konuşmayı Durdur", bg="#F44336")
         self.status_var.set("Kayıt yapılıyor...")
         
+        self.transcriber.reset_stream()
+        self.recorder.get_audio_data()
         self.recorder.start()
         
         self.transcription_thread = threading.Thread(target=self.transcribe_loop, daemon=True)
@@ -215,15 +250,20 @@ class SpeechToTextApp:
         
         audio_data = self.recorder.get_buffer_audio()
         if audio_data is not None and len(audio_data) > 0:
-            text = self.transcriber.transcribe_audio(audio_data, language=self.language)
+            text = self.transcriber.transcribe_audio(
+                audio_data, self.recorder.sample_rate, language=self.language
+            )
             self.update_transcription(text)
     
     def transcribe_loop(self):
         while self.is_transcribing:
-            audio_data = self.recorder.get_buffer_audio()
+            audio_data = self.recorder.get_audio_data()
             
             if audio_data is not None and len(audio_data) > 0:
-                text = self.transcriber.transcribe_audio(audio_data, language=self.language)
+                text = self.transcriber.transcribe_stream(
+                    audio_data, self.recorder.buffer_duration, language=self.language,
+                    sample_rate=self.recorder.sample_rate
+                )
                 self.root.after(0, lambda t=text: self.update_transcription(t))
             
             time.sleep(2)
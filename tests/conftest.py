@@ -2,6 +2,9 @@ import random as rand
 
 import numpy
 import pytest
+import torch
+
+from whisper.model import ModelDimensions, Whisper
 
 
 def pytest_configure(config):
@@ -12,3 +15,26 @@ def pytest_configure(config):
 def random():
     rand.seed(42)
     numpy.random.seed(42)
+
+
+@pytest.fixture(scope="session")
+def random_model():
+    """A small multilingual Whisper model with random weights, for testing without downloads"""
+    dims = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=64,
+        n_audio_head=4,
+        n_audio_layer=2,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=64,
+        n_text_head=4,
+        n_text_layer=2,
+    )
+    generator = torch.Generator().manual_seed(0)
+    model = Whisper(dims)
+    for param in model.parameters():
+        if param.ndim > 1:
+            param.data.normal_(std=0.1, generator=generator)
+    return model.eval()
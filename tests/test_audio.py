@@ -1,8 +1,29 @@
 import os.path
+import wave
 
 import numpy as np
+import pytest
+import torch
 
-from whisper.audio import SAMPLE_RATE, load_audio, log_mel_spectrogram
+from whisper.audio import (
+    AUDIO_DECODERS,
+    HOP_LENGTH,
+    N_FFT,
+    N_FRAMES,
+    N_SAMPLES,
+    SAMPLE_RATE,
+    MelWindowPool,
+    MelWindowReader,
+    Resampler,
+    StreamingMelFrontend,
+    load_audio,
+    log_mel_spectrogram,
+    log_mel_spectrogram_batch,
+    mel_filters,
+    pad_or_trim,
+    resample,
+    stream_audio,
+)
 
 
 def test_audio():
@@ -17,3 +38,173 @@ def test_audio():
 
     assert np.allclose(mel_from_audio, mel_from_file)
     assert mel_from_audio.max() - mel_from_audio.min() <= 2.0
+
+
+def test_stream_audio():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+
+    chunks = list(stream_audio(audio_path, chunk_size=SAMPLE_RATE))
+    assert all(len(chunk) == SAMPLE_RATE for chunk in chunks[:-1])
+    assert np.array_equal(np.concatenate(chunks), audio)
+
+    reader = MelWindowReader(chunks)
+    num_frames = reader.fill(N_FRAMES)
+    assert reader.eof and num_frames == audio.shape[0] // HOP_LENGTH
+
+    # identical to the full spectrogram when the window covers the whole audio,
+    # except for the last frames which are zero-padded instead of reflect-padded
+    mel_from_reader = reader.window(0, num_frames)
+    mel_from_audio = log_mel_spectrogram(audio)
+    assert np.allclose(mel_from_reader[:, :-2], mel_from_audio[:, : num_frames - 2])
+
+    reader.release(500)
+    assert reader.window(500, 100).shape == (80, 100)
+    with pytest.raises(ValueError):
+        reader.window(0, 100)
+
+
+def test_audio_decoders(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path, backend="ffmpeg")
+    pcm = (audio * 32768).astype("<i2")
+
+    wav_path = str(tmp_path / "jfk.wav")
+    with wave.open(wav_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    raw_path = str(tmp_path / "jfk.pcm")
+    pcm.tofile(raw_path)
+
+    assert np.array_equal(load_audio(wav_path, backend="wave"), audio)
+    assert np.array_equal(load_audio(wav_path, backend="ffmpeg"), audio)
+    assert np.array_equal(load_audio(raw_path), audio)
+
+    # in-process decoders skip the files they don't support
+    assert AUDIO_DECODERS["wave"](audio_path, SAMPLE_RATE) is None
+    assert AUDIO_DECODERS["wave"](wav_path, SAMPLE_RATE * 2) is None
+    with pytest.raises(RuntimeError):
+        load_audio(audio_path, backend="raw")
+
+
+def test_audio_padding():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    padded = load_audio(audio_path, padding=N_SAMPLES)
+    assert padded.dtype == np.float32 and len(padded) == len(audio) + N_SAMPLES
+    assert (
+        np.array_equal(padded[: len(audio)], audio) and not padded[len(audio) :].any()
+    )
+
+    # the padded spectrogram is computed in blocks, and equals the one over the padded array
+    mel_from_file = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+    window = torch.hann_window(N_FFT)
+    stft = torch.stft(
+        torch.from_numpy(padded), N_FFT, HOP_LENGTH, window=window, return_complex=True
+    )
+    log_spec = (
+        (mel_filters("cpu", 80) @ stft[..., :-1].abs() ** 2).clamp(min=1e-10).log10()
+    )
+    log_spec = (torch.maximum(log_spec, log_spec.max() - 8.0) + 4.0) / 4.0
+    assert mel_from_file.shape == log_spec.shape and N_FRAMES < log_spec.shape[1]
+    assert np.allclose(mel_from_file, log_spec, atol=1e-6)
+
+    # trimmed windows are views of the padded arrays
+    segment = pad_or_trim(padded[SAMPLE_RATE:])
+    assert len(segment) == N_SAMPLES and np.shares_memory(segment, padded)
+    assert pad_or_trim(mel_from_file, N_FRAMES)._base is mel_from_file
+
+
+@pytest.mark.parametrize("sample_rate", [44100, 48000])
+def test_resample(sample_rate):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    native = load_audio(audio_path, sr=sample_rate)
+
+    # close to resampling with ffmpeg
+    resampled = resample(native, sample_rate)
+    assert resampled.dtype == np.float32 and resampled.shape == audio.shape
+    assert np.sqrt(np.mean((resampled - audio) ** 2)) < 1e-3 * audio.std()
+
+    mel = log_mel_spectrogram(native, sample_rate=sample_rate)
+    assert torch.equal(mel, log_mel_spectrogram(resampled))
+
+    # audio files are decoded at 16 kHz regardless of the sample rate
+    expected = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+    mel = log_mel_spectrogram(audio_path, padding=N_SAMPLES, sample_rate=sample_rate)
+    assert torch.equal(mel, expected)
+
+    # the same when resampling in chunks
+    resampler = Resampler(sample_rate)
+    chunks = [native[i : i + 1000] for i in range(0, len(native), 1000)]
+    streamed = [resampler.push(chunk) for chunk in chunks] + [resampler.flush()]
+    assert np.allclose(np.concatenate(streamed), resampled, atol=1e-6)
+
+
+def test_mel_window_pool():
+    mel = torch.randn(80, N_FRAMES * 2)
+    pool = MelWindowPool(80, N_FRAMES, dtype=torch.float16, size=2)
+
+    windows = [pool.fill(mel[:, :size]) for size in [N_FRAMES * 2, 1000, 2000, 500]]
+    for window, size in zip(windows[2:], [2000, 500]):
+        expected = pad_or_trim(mel[:, :size], N_FRAMES).half()
+        assert window.dtype == torch.float16 and torch.equal(window, expected)
+    assert windows[0] is windows[2] and windows[1] is windows[3]
+
+    # full windows that need no conversion are not copied
+    pool = MelWindowPool(80, N_FRAMES, dtype=torch.float32)
+    assert pool.fill(mel[:, 10:])._base is mel
+
+
+@pytest.mark.parametrize("chunk_size", [1000, SAMPLE_RATE * 2])
+def test_streaming_mel_frontend(chunk_size):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    mel_from_audio = log_mel_spectrogram(audio)
+
+    frontend = StreamingMelFrontend()
+    chunks = [audio[i : i + chunk_size] for i in range(0, len(audio), chunk_size)]
+    mel_chunks = [frontend.push(chunk) for chunk in chunks] + [frontend.flush()]
+    mel_from_frontend = torch.cat(mel_chunks, dim=1)
+    assert mel_from_frontend.shape == mel_from_audio.shape
+
+    # the streaming floor is never above the global one, and the frames are otherwise equal
+    clamped = torch.maximum(mel_from_frontend, mel_from_audio.min())
+    assert np.allclose(clamped, mel_from_audio, atol=1e-5)
+
+
+def test_streaming_mel_frontend_clamp_window():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+
+    # each frame is clamped to 80 dB below its own maximum, which is 2.0 after the scaling,
+    # and no maxima are kept for the next frames
+    frontend = StreamingMelFrontend(clamp_frames=1)
+    mel = torch.cat(
+        [frontend.push(audio[i : i + 1000]) for i in range(0, 32000, 1000)], 1
+    )
+    assert len(frontend.frame_maxima) == 0
+    assert torch.all(mel.min(dim=0).values >= mel.max(dim=0).values - 2.0 - 1e-5)
+
+    frontend = StreamingMelFrontend(clamp_frames=100)
+    frontend.push(audio[:32000])
+    assert len(frontend.frame_maxima) == 99
+
+    with pytest.raises(ValueError):
+        StreamingMelFrontend(clamp_frames=0)
+
+
+def test_log_mel_spectrogram_batch():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    audios = [audio[: SAMPLE_RATE * 3], audio[SAMPLE_RATE:], np.tile(audio, 3)]
+
+    mel, lengths = log_mel_spectrogram_batch(audios)
+    assert mel.shape == (3, 80, N_FRAMES)
+    assert lengths.tolist() == [300, len(audio) // HOP_LENGTH - 100, N_FRAMES]
+
+    for i, audio in enumerate(audios):
+        expected = pad_or_trim(log_mel_spectrogram(audio), N_FRAMES)
+        assert np.allclose(mel[i], expected, atol=1e-6)
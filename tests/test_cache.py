@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import torch
+
+from whisper.audio import N_SAMPLES, load_audio, log_mel_spectrogram
+from whisper.cache import AudioCache
+
+
+def test_audio_cache(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    cache = AudioCache(str(tmp_path / "cache"))
+
+    audio = load_audio(audio_path)
+    assert cache.get(audio_path, "audio", sr=16000, padding=0) is None
+    assert np.array_equal(load_audio(audio_path, cache=cache), audio)
+    assert isinstance(cache.get(audio_path, "audio", sr=16000, padding=0), np.memmap)
+
+    mel = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+    mel_from_cache = log_mel_spectrogram(audio_path, padding=N_SAMPLES, cache=cache)
+    assert torch.equal(mel_from_cache, mel)
+    assert cache.get(audio_path, "mel", n_mels=80, padding=0) is None
+    assert cache.get(audio_path, "mel", n_mels=80, padding=N_SAMPLES) is not None
+
+
+def test_audio_cache_eviction(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    array = np.zeros(1000, dtype=np.float32)
+    cache = AudioCache(str(tmp_path), max_size=int(array.nbytes * 3.5))
+
+    for i in range(3):
+        cache.put(audio_path, "test", array, index=i)
+        os.utime(cache.path(audio_path, "test", index=i), (i, i))
+    cache.get(audio_path, "test", index=0)  # marks the first one as recently used
+    cache.put(audio_path, "test", array, index=3)
+
+    cached = [cache.get(audio_path, "test", index=i) is not None for i in range(4)]
+    assert cached == [True, False, True, True]
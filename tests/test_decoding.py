@@ -0,0 +1,280 @@
+import copy
+import os
+from dataclasses import replace
+
+import pytest
+import torch
+
+from whisper.audio import load_audio, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import (
+    BeamSearchDecoder,
+    DecodingOptions,
+    Inference,
+    decode,
+    ends_in_repetition_loop,
+)
+from whisper.model import fuse_projections, quantize_int8, to_bfloat16
+
+
+@pytest.fixture(scope="module")
+def mel():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    return pad_or_trim(log_mel_spectrogram(audio_path), 3000)
+
+
+@pytest.mark.parametrize("options", [dict(beam_size=3), dict()])
+def test_static_kv_cache(random_model, mel, options):
+    options = dict(language="en", fp16=False, sample_len=20, **options)
+    results = [
+        decode(random_model, mel, DecodingOptions(static_kv_cache=static, **options))
+        for static in [False, True]
+    ]
+    assert len(results[0].tokens) > 0
+    assert results[0].tokens == results[1].tokens
+    assert torch.isclose(
+        torch.tensor(results[0].avg_logprob), torch.tensor(results[1].avg_logprob)
+    )
+
+
+# the candidates sampled at a near-zero temperature are the greedy tokens
+@pytest.mark.parametrize(
+    "options, single_options",
+    [(dict(beam_size=3), dict(beam_size=3)), (dict(best_of=2, temperature=1e-6), {})],
+)
+def test_shared_cross_attention(random_model, mel, options, single_options):
+    shared = DecodingOptions(language="en", fp16=False, sample_len=20)
+    mels = torch.stack([mel, mel.roll(700, dims=-1)])
+
+    batched = decode(random_model, mels, replace(shared, **options))
+    single = [decode(random_model, m, replace(shared, **single_options)) for m in mels]
+
+    assert [result.audio_features.shape for result in batched] == [(1500, 64)] * 2
+    assert [result.tokens for result in batched] == [r.tokens for r in single]
+    assert torch.allclose(
+        torch.tensor([r.avg_logprob for r in batched]),
+        torch.tensor([r.avg_logprob for r in single]),
+    )
+
+
+def test_quantize_int8(random_model, mel):
+    model = quantize_int8(copy.deepcopy(random_model))
+    tokens = torch.tensor([[50258, 50259, 50359]])
+    with torch.no_grad():
+        expected = random_model.logits(tokens, random_model.embed_audio(mel[None]))
+        logits = model.logits(tokens, model.embed_audio(mel[None]))
+    assert torch.allclose(logits, expected, rtol=0.1, atol=0.1 * expected.abs().max())
+
+    options = DecodingOptions(language="en", fp16=False, sample_len=20)
+    assert len(decode(model, mel, options).tokens) > 0
+
+
+def test_bfloat16(random_model, mel):
+    model = to_bfloat16(copy.deepcopy(random_model))
+    assert model.decoder.ln.weight.dtype == torch.float32
+    tokens = torch.tensor([[50258, 50259, 50359]])
+    with torch.no_grad():
+        expected = random_model.logits(tokens, random_model.embed_audio(mel[None]))
+        audio_features = model.embed_audio(mel[None].bfloat16())
+        logits = model.logits(tokens, audio_features)
+    assert audio_features.dtype == torch.bfloat16 and logits.dtype == torch.float32
+    assert torch.allclose(logits, expected, rtol=0.1, atol=0.1 * expected.abs().max())
+
+    options = DecodingOptions(language="en", bf16=True, sample_len=20)
+    result = decode(model, mel, options)
+    assert result.audio_features.dtype == torch.bfloat16 and len(result.tokens) > 0
+
+
+@pytest.mark.parametrize("audio_ctx", [100, 500])
+def test_audio_ctx(random_model, mel, audio_ctx):
+    options = dict(language="en", fp16=False, sample_len=20, audio_ctx=audio_ctx)
+    results = [
+        decode(random_model, mel, DecodingOptions(static_kv_cache=static, **options))
+        for static in [False, True]
+    ]
+    assert results[0].audio_features.shape == (audio_ctx, 64)
+    assert results[0].tokens == results[1].tokens
+
+    # timestamps after the end of the encoded audio are suppressed
+    timestamp_begin = 50364
+    timestamps = [
+        t - timestamp_begin for t in results[0].tokens if t >= timestamp_begin
+    ]
+    assert all(t <= audio_ctx for t in timestamps)
+
+    with pytest.raises(ValueError):
+        decode(random_model, mel, DecodingOptions(audio_ctx=2000))
+
+    # the mel is trimmed to the audio context only if it is given
+    with pytest.raises(ValueError):
+        decode(random_model, mel[:, :1000], DecodingOptions(language="en", fp16=False))
+
+
+@pytest.mark.parametrize("options", [dict(), dict(beam_size=3, static_kv_cache=False)])
+def test_fuse_projections(random_model, mel, options):
+    model = fuse_projections(copy.deepcopy(random_model))
+    with torch.no_grad():
+        expected = random_model.embed_audio(mel[None])
+        assert torch.allclose(model.embed_audio(mel[None]), expected, atol=1e-5)
+
+    options = DecodingOptions(language="en", fp16=False, sample_len=20, **options)
+    expected = decode(random_model, mel, options)
+    assert decode(model, mel, options).tokens == expected.tokens
+
+
+def test_logit_positions(random_model, mel):
+    decoder = copy.deepcopy(random_model.decoder)
+    tokens = torch.tensor([[50258, 50259, 50359, 1000, 2000]])
+    with torch.no_grad():
+        audio_features = random_model.embed_audio(mel[None])
+        logits = decoder(tokens, audio_features)
+        assert torch.allclose(
+            decoder(tokens, audio_features, positions=[0, -1]),
+            logits[:, [0, -1]],
+            atol=1e-4,
+        )
+
+    # the embedding cast to another dtype is reused until the weights are modified
+    weight = decoder.embedding_weight(torch.float16)
+    assert weight.dtype == torch.float16
+    assert decoder.embedding_weight(torch.float16) is weight
+    with torch.no_grad():
+        decoder.token_embedding.weight.mul_(2)
+    expected = decoder.token_embedding.weight.half()
+    assert torch.equal(decoder.embedding_weight(torch.float16), expected)
+
+
+def test_beam_search_update():
+    class RecordingInference(Inference):
+        def rearrange_kv_cache(self, source_indices):
+            self.source_indices = source_indices
+
+    eot, inference = 4, RecordingInference()
+    decoder = BeamSearchDecoder(beam_size=2, eot=eot, inference=inference)
+    sum_logprobs = torch.zeros(2)
+
+    # the identical beams of the first update propose each sequence once
+    tokens = torch.tensor([[0], [0]])
+    probs = torch.tensor([[0.05, 0.5, 0.12, 0.08, 0.25]] * 2)
+    tokens, completed = decoder.update(tokens, probs.log(), sum_logprobs)
+    assert tokens.tolist() == [[0, 1], [0, 2]] and not completed
+    assert torch.allclose(sum_logprobs, torch.tensor([0.5, 0.12]).log())
+
+    # a second finished sequence completes the search
+    probs = torch.tensor([[0.04, 0.12, 0.06, 0.08, 0.7], [0.6, 0.11, 0.05, 0.15, 0.09]])
+    tokens, completed = decoder.update(tokens, probs.log(), sum_logprobs)
+    assert tokens.tolist() == [[0, 2, 0], [0, 1, 1]] and completed
+    assert inference.source_indices == [1, 0]
+
+    sequences, logprobs = decoder.finalize(tokens[None], sum_logprobs[None])
+    assert [t.tolist() for t in sequences[0]] == [[0, 4], [0, 1, 4]]
+    assert torch.allclose(torch.tensor(logprobs[0]), torch.tensor([0.25, 0.35]).log())
+
+
+@pytest.mark.parametrize("options", [dict(), dict(beam_size=3)])
+def test_heterogeneous_batch(random_model, mel, options):
+    shared = DecodingOptions(fp16=False, sample_len=20, **options)
+    items = [
+        replace(shared, language="en", prompt="And so my fellow Americans"),
+        replace(shared, task="translate", prefix="ask not"),
+        replace(shared, language="de"),
+    ]
+    mels = torch.stack([mel, mel.roll(700, dims=-1), mel.roll(1400, dims=-1)])
+
+    batched = decode(random_model, mels, items)
+    single = [decode(random_model, mel, item) for mel, item in zip(mels, items)]
+    assert [r.tokens for r in batched] == [r.tokens for r in single]
+    assert [r.language for r in batched] == [r.language for r in single]
+    assert torch.allclose(
+        torch.tensor([r.no_speech_prob for r in batched]),
+        torch.tensor([r.no_speech_prob for r in single]),
+    )
+
+    with pytest.raises(ValueError):
+        decode(random_model, mels, [*items[:2], replace(items[2], beam_size=2)])
+
+
+def test_detect_language_batch(random_model, mel):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    mels = torch.stack([mel, mel.roll(700, dims=-1)])
+    language_tokens, probs = random_model.detect_language_batch(mels)
+    expected_tokens, expected_probs = random_model.detect_language(mels)
+    assert torch.equal(language_tokens, expected_tokens)
+    assert probs.shape == (2, len(expected_probs[0]))
+    assert probs.tolist() == [list(p.values()) for p in expected_probs]
+
+    # the paths and the waveforms of the files are encoded as a batch
+    language_tokens, probs = random_model.detect_language_batch(
+        [audio_path, audio[:16000]]
+    )
+    assert language_tokens[0] == expected_tokens[0]
+    assert torch.allclose(probs.sum(dim=-1), torch.ones(2))
+
+    # short mels are encoded, and the audio features of a short audio context are not, even
+    # with as many positions as the mels have rows
+    for n_frames in [100, 2 * random_model.dims.n_mels]:
+        short_mels = mels[..., :n_frames]
+        language_tokens, probs = random_model.detect_language_batch(short_mels)
+        with torch.no_grad():
+            audio_features = random_model.embed_audio(short_mels)
+        assert audio_features.shape[1] == n_frames // 2
+        expected = random_model.detect_language_batch(audio_features)
+        assert torch.equal(language_tokens, expected[0])
+        assert torch.allclose(probs, expected[1])
+
+
+def test_abort_no_speech(random_model, mel):
+    mels = torch.stack([mel, mel.roll(700, dims=-1)])
+    options = DecodingOptions(language="en", fp16=False, sample_len=20)
+    expected = decode(random_model, mels, options)
+    threshold = sum(result.no_speech_prob for result in expected) / 2
+
+    results = decode(
+        random_model,
+        mels,
+        replace(
+            options, abort_no_speech_threshold=threshold, abort_logprob_threshold=0.0
+        ),
+    )
+    aborted = [result.no_speech_prob > threshold for result in expected]
+    assert sorted(aborted) == [False, True]
+    for result, expected_result, abort in zip(results, expected, aborted):
+        assert result.no_speech_prob == expected_result.no_speech_prob
+        if abort:
+            assert result.tokens == [] and result.text == ""
+            assert result.avg_logprob < 0
+        else:
+            assert result.tokens == expected_result.tokens
+
+
+def test_repetition_loop(random_model, mel):
+    timestamp_begin = 50364
+    tokens = torch.tensor(
+        [
+            [7, 1, 2, 50370, 1, 2, 50380, 1, 2, 50391],  # timestamps increase in a loop
+            [7, 1, 2, 50370, 1, 2, 50380, 1, 3, 50391],
+            [1, 2, 1, 2, 1, 2, 1, 2, 1, 2],
+        ]
+    )
+    looped = ends_in_repetition_loop(tokens, timestamp_begin, max_repetitions=3)
+    assert looped.tolist() == [True, False, True]
+    looped = ends_in_repetition_loop(tokens, timestamp_begin, max_repetitions=5)
+    assert looped.tolist() == [False, False, True]
+
+    # the timestamps of a segment boundary are not a repeated phrase
+    tokens = torch.tensor([[50364, 100, 200, 50414, 50414]])
+    assert not ends_in_repetition_loop(tokens, timestamp_begin, max_repetitions=2)
+    tokens = torch.tensor([[50364, 100, 200, 50414, 50414, 300, 400, 50420, 50420]])
+    assert not ends_in_repetition_loop(tokens, timestamp_begin, max_repetitions=3)
+
+    # the random model repeats a token until the sample length runs out
+    options = DecodingOptions(language="en", fp16=False, sample_len=100)
+    expected = decode(random_model, mel, options)
+    assert len(expected.tokens) == 100 and not expected.repetition_loop
+
+    result = decode(random_model, mel, replace(options, max_repetitions=3))
+    assert result.repetition_loop and len(result.tokens) < 100
+    assert result.tokens == expected.tokens[: len(result.tokens)]
+
+    with pytest.raises(ValueError):
+        decode(random_model, mel, replace(options, max_repetitions=2))
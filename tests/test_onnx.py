@@ -0,0 +1,67 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from whisper.audio import load_audio, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import DecodingOptions, decode
+from whisper.model import fuse_projections, quantize_int8, to_bfloat16
+from whisper.onnx import export_onnx
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+
+@pytest.fixture(scope="module")
+def onnx_model_dir(random_model, tmp_path_factory):
+    return export_onnx(random_model, str(tmp_path_factory.mktemp("onnx")))
+
+
+@pytest.mark.parametrize("options", [dict(), dict(beam_size=3)])
+def test_onnx_inference(random_model, onnx_model_dir, options):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    mel = pad_or_trim(log_mel_spectrogram(audio_path), 3000)
+    mels = torch.stack([mel, mel.roll(700, dims=-1)])
+
+    options = dict(language="en", fp16=False, sample_len=20, **options)
+    expected = decode(random_model, mels, DecodingOptions(**options))
+    options = DecodingOptions(onnx_model_dir=onnx_model_dir, **options)
+    results = decode(random_model, mels, options)
+
+    for result, reference in zip(results, expected):
+        assert torch.allclose(
+            result.audio_features, reference.audio_features, atol=1e-4
+        )
+        assert result.tokens == reference.tokens
+
+
+def test_onnx_batched_windows(random_model, onnx_model_dir):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = np.tile(load_audio(audio_path), 6)
+    options = dict(
+        language="en",
+        fp16=False,
+        sample_len=20,
+        temperature=0.0,
+        condition_on_previous_text=False,
+        initial_prompt="And so my fellow Americans",
+        batch_size=2,
+    )
+
+    # the first window is decoded with the prompt on its own, without padding
+    result = random_model.transcribe(audio, onnx_model_dir=onnx_model_dir, **options)
+    expected = random_model.transcribe(audio, **options)
+    assert len(result["segments"]) > 0
+    assert [s["tokens"] for s in result["segments"]] == [
+        s["tokens"] for s in expected["segments"]
+    ]
+
+
+@pytest.mark.parametrize("convert", [fuse_projections, quantize_int8, to_bfloat16])
+def test_export_unsupported_models(random_model, tmp_path, convert):
+    model = convert(copy.deepcopy(random_model))
+    with pytest.raises(ValueError):
+        export_onnx(model, str(tmp_path))
+    assert os.listdir(tmp_path) == []
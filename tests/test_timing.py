@@ -1,9 +1,14 @@
+import os
+
 import numpy as np
 import pytest
 import scipy.ndimage
 import torch
 
-from whisper.timing import dtw_cpu, dtw_cuda, median_filter
+from whisper.audio import N_FRAMES, log_mel_spectrogram, pad_or_trim
+from whisper.model import disable_sdpa
+from whisper.timing import dtw_cpu, dtw_cuda, find_alignment, median_filter
+from whisper.tokenizer import get_tokenizer
 
 sizes = [
     (10, 20),
@@ -94,3 +99,23 @@ def test_median_filter_equivalence(shape):
         filtered_gpu = median_filter(x.cuda(), filter_width).cpu()
 
         assert np.allclose(filtered_cpu, filtered_gpu)
+
+
+def test_find_alignment_audio_features(random_model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    mel = pad_or_trim(log_mel_spectrogram(audio_path), N_FRAMES)
+    tokenizer = get_tokenizer(random_model.is_multilingual, language="en")
+    text_tokens = tokenizer.encode(" And so my fellow Americans")
+
+    expected = find_alignment(random_model, tokenizer, text_tokens, mel, N_FRAMES)
+    with torch.no_grad(), disable_sdpa():
+        audio_features = random_model.embed_audio(mel[None])[0]
+    alignment = find_alignment(
+        random_model,
+        tokenizer,
+        text_tokens,
+        mel,
+        N_FRAMES,
+        audio_features=audio_features,
+    )
+    assert alignment == expected
@@ -1,10 +1,13 @@
 import os
 
+import numpy as np
 import pytest
 import torch
 
 import whisper
+from whisper.audio import N_SAMPLES, load_audio, log_mel_spectrogram
 from whisper.tokenizer import get_tokenizer
+from whisper.transcribe import prefetch_mel_spectrograms
 
 
 @pytest.mark.parametrize("model_name", whisper.available_models())
@@ -40,3 +43,142 @@ def test_transcribe(model_name: str):
                 timing_checked = True
 
     assert timing_checked
+
+
+def test_prefetch_mel_spectrograms():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    files = [audio_path, "nonexistent.flac", audio_path]
+
+    results = list(prefetch_mel_spectrograms(files, depth=2))
+    assert [file for file, _ in results] == files
+    with pytest.raises(RuntimeError):
+        results[1][1].result()
+
+    mel = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+    assert torch.equal(results[0][1].result(), mel)
+    assert torch.equal(results[2][1].result(), mel)
+
+    # only `depth` files are read ahead of the one being worked on
+    consumed = []
+
+    def record(files):
+        for file in files:
+            consumed.append(file)
+            yield file
+
+    for i, (file, future) in enumerate(
+        prefetch_mel_spectrograms(record([audio_path] * 4), depth=2), start=1
+    ):
+        assert len(consumed) == min(i + 2, 4)
+        future.result()
+
+
+@pytest.mark.parametrize("word_timestamps", [False, True])
+def test_fallback_encoder_calls(random_model, word_timestamps):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    calls = []
+    hook = random_model.encoder.register_forward_hook(lambda *_: calls.append(1))
+    try:
+        # every window falls back to the last temperature
+        result = random_model.transcribe(
+            audio_path,
+            language="en",
+            fp16=False,
+            sample_len=20,
+            temperature=(0.0, 0.5, 1.0),
+            compression_ratio_threshold=0.0,
+            word_timestamps=word_timestamps,
+            count_encoder_calls=True,
+        )
+    finally:
+        hook.remove()
+
+    assert {segment["temperature"] for segment in result["segments"]} == {1.0}
+    assert result["encoder_calls"] == [1] * len(result["encoder_calls"])
+    assert len(calls) == len(result["encoder_calls"])
+
+
+def test_language_detection_encoder_calls(random_model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    # the first window is 30 seconds of audio
+    audio = np.tile(load_audio(audio_path), 3)
+    options = dict(fp16=False, sample_len=20, temperature=0.0, count_encoder_calls=True)
+
+    calls = []
+    hook = random_model.encoder.register_forward_hook(lambda *_: calls.append(1))
+    try:
+        result = random_model.transcribe(audio, **options)
+    finally:
+        hook.remove()
+
+    # the first window is decoded from the features of the language detection
+    assert result["encoder_calls"][0] == 0
+    assert len(calls) == 1 + sum(result["encoder_calls"])
+
+    expected = random_model.transcribe(audio, language=result["language"], **options)
+    assert result["segments"] == expected["segments"]
+
+
+def test_abort_silent_windows(random_model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = np.tile(load_audio(audio_path), 4)
+    # every window is silent with these thresholds
+    options = dict(
+        language="en", fp16=False, no_speech_threshold=0.0, logprob_threshold=0.0
+    )
+
+    steps = []
+    hook = random_model.decoder.register_forward_hook(lambda *_: steps.append(1))
+    try:
+        result = random_model.transcribe(
+            audio, abort_silent_windows=True, count_encoder_calls=True, **options
+        )
+    finally:
+        hook.remove()
+
+    assert len(steps) == len(result["encoder_calls"])  # one decoder step per window
+    expected = random_model.transcribe(audio, **options)
+    assert result["segments"] == expected["segments"]
+    assert "encoder_calls" not in expected  # only counted on request
+
+
+def test_batched_windows(random_model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = np.tile(load_audio(audio_path), 8)  # windows at 0, 25, 50 and 75 seconds
+    options = dict(
+        language="en",
+        fp16=False,
+        sample_len=20,
+        condition_on_previous_text=False,
+        count_encoder_calls=True,
+        compression_ratio_threshold=None,
+    )
+
+    result = random_model.transcribe(audio, batch_size=3, temperature=0.0, **options)
+    expected = random_model.transcribe(audio, batch_size=1, temperature=0.0, **options)
+    assert [s["tokens"] for s in result["segments"]] == [
+        s["tokens"] for s in expected["segments"]
+    ]
+    assert result["encoder_calls"] == [1] * 4
+    assert {s["seek"] for s in result["segments"]} <= {0, 2500, 5000, 7500}
+
+    # the segments of the overlaps are kept from one of the windows
+    segments = result["segments"]
+    for previous, segment in zip(segments, segments[1:]):
+        assert (segment["start"] + segment["end"]) / 2 >= previous["end"]
+    assert result["text"] == "".join(s["text"] for s in segments)
+
+    # only the windows that fail are decoded again, from their audio features
+    result = random_model.transcribe(
+        audio,
+        batch_size=3,
+        temperature=(0.0, 1.0),
+        logprob_threshold=0.0,
+        no_speech_threshold=None,
+        **options,
+    )
+    assert {s["temperature"] for s in result["segments"]} == {1.0}
+    assert result["encoder_calls"] == [1] * 4
+
+    with pytest.raises(ValueError):
+        random_model.transcribe(audio, batch_size=2, language="en")
@@ -8,9 +8,28 @@ from typing import List, Optional, Union
 import torch
 from tqdm import tqdm
 
-from .audio import load_audio, log_mel_spectrogram, pad_or_trim
-from .decoding import DecodingOptions, DecodingResult, decode, detect_language
-from .model import ModelDimensions, Whisper
+from .audio import (
+    load_audio,
+    log_mel_spectrogram,
+    log_mel_spectrogram_batch,
+    pad_or_trim,
+    stream_audio,
+)
+from .cache import AudioCache
+from .decoding import (
+    DecodingOptions,
+    DecodingResult,
+    decode,
+    detect_language,
+    detect_language_batch,
+)
+from .model import (
+    ModelDimensions,
+    Whisper,
+    fuse_projections,
+    quantize_int8,
+    to_bfloat16,
+)
 from .transcribe import transcribe
 from .version import __version__
 
@@ -105,6 +124,9 @@ def load_model(
     device: Optional[Union[str, torch.device]] = None,
     download_root: str = None,
     in_memory: bool = False,
+    quantize: Optional[str] = None,
+    bf16: bool = False,
+    fused: bool = False,
 ) -> Whisper:
     """
     Load a Whisper ASR model
@@ -120,6 +142,15 @@ def load_model(
         path to download the model files; by default, it uses "~/.cache/whisper"
     in_memory: bool
         whether to preload the model weights into host memory
+    quantize: Optional[str]
+        if "int8", the weights of the linear layers and the token embedding are quantized to int8,
+        for faster inference on CPU with less memory, at a small cost in accuracy
+    bf16: bool
+        whether to store the weights in bfloat16, halving their memory; use with
+        `DecodingOptions(bf16=True)` for inference in bfloat16, e.g. on CPUs that support it
+    fused: bool
+        whether to fuse the query, key and value projections of each attention layer, and the
+        layers of each MLP, into fewer modules and matrix multiplications
 
     Returns
     -------
@@ -129,6 +160,10 @@ def load_model(
 
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    if quantize not in {None, "int8"}:
+        raise ValueError(f"Unsupported quantization: {quantize}")
+    if quantize == "int8" and torch.device(device).type != "cpu":
+        raise ValueError("int8 quantization is only supported on CPU")
     if download_root is None:
         default = os.path.join(os.path.expanduser("~"), ".cache")
         download_root = os.path.join(os.getenv("XDG_CACHE_HOME", default), "whisper")
@@ -157,4 +192,11 @@ def load_model(
     if alignment_heads is not None:
         model.set_alignment_heads(alignment_heads)
 
-    return model.to(device)
+    model = model.to(device)
+    if fused:
+        fuse_projections(model)
+    if quantize == "int8":
+        quantize_int8(model)
+    if bf16:
+        to_bfloat16(model)
+    return model
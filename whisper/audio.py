@@ -1,14 +1,23 @@
+import math
 import os
-from functools import lru_cache
-from subprocess import CalledProcessError, run
-from typing import Optional, Union
+import tempfile
+import wave
+from functools import lru_cache, partial
+from subprocess import PIPE, CalledProcessError, Popen, run
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
 import torch.nn.functional as F
 
+from .cache import AudioCache
 from .utils import exact_div
 
+try:
+    import soundfile
+except (ImportError, OSError):  # OSError is raised when libsndfile is not installed
+    soundfile = None
+
 # hard-coded audio hyperparameters
 SAMPLE_RATE = 16000
 N_FFT = 400
@@ -22,7 +31,13 @@ FRAMES_PER_SECOND = exact_div(SAMPLE_RATE, HOP_LENGTH)  # 10ms per audio frame
 TOKENS_PER_SECOND = exact_div(SAMPLE_RATE, N_SAMPLES_PER_TOKEN)  # 20ms per audio token
 
 
-def load_audio(file: str, sr: int = SAMPLE_RATE):
+def load_audio(
+    file: str,
+    sr: int = SAMPLE_RATE,
+    backend: Optional[str] = None,
+    cache: Optional[AudioCache] = None,
+    padding: int = 0,
+):
     """
     Open an audio file and read as mono waveform, resampling as necessary
 
@@ -34,13 +49,39 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     sr: int
         The sample rate to resample the audio if necessary
 
+    backend: Optional[str]
+        The name of the decoder in `AUDIO_DECODERS` to use. By default, the in-process decoders
+        are tried first, and the ffmpeg CLI is used for the files that they do not support.
+
+    cache: Optional[AudioCache]
+        If given, the decoded waveform is stored in and loaded from this cache
+
+    padding: int
+        Number of zero samples to append; the samples are decoded into a buffer that already
+        has room for them, so that the waveform does not need to be copied again to pad it
+
     Returns
     -------
     A NumPy array containing the audio waveform, in float32 dtype.
     """
+    if cache is not None:
+        decode = partial(load_audio, file, sr, backend, padding=padding)
+        return cache.get_or_compute(file, "audio", decode, sr=sr, padding=padding)
+
+    names = list(AUDIO_DECODERS) if backend is None else [backend]
+    for name in names:
+        audio = AUDIO_DECODERS[name](file, sr, padding=padding)
+        if audio is not None:
+            return audio
+
+    raise RuntimeError(f"Failed to load audio: {file} is not supported by {backend}")
+
+
+def decode_audio_ffmpeg(file: str, sr: int, padding: int = 0) -> np.ndarray:
+    """Decode any audio file that ffmpeg supports; requires the ffmpeg CLI in PATH"""
 
     # This launches a subprocess to decode audio while down-mixing
-    # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
+    # and resampling as necessary.
     # fmt: off
     cmd = [
         "ffmpeg",
@@ -59,18 +100,168 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     except CalledProcessError as e:
         raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
 
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    return _int16_to_mono(np.frombuffer(out, np.int16), 1, padding)
+
+
+def _int16_to_mono(
+    samples: np.ndarray, n_channels: int, padding: int = 0
+) -> np.ndarray:
+    """Convert int16 PCM into a new float32 buffer, followed by `padding` zero samples"""
+    samples = samples.reshape(-1, n_channels)
+    audio = np.zeros(len(samples) + padding, dtype=np.float32)
+    if n_channels > 1:
+        # down-mix by averaging the channels, like ffmpeg does
+        samples.mean(axis=1, dtype=np.float32, out=audio[: len(samples)])
+        audio[: len(samples)] /= 32768.0
+    else:
+        # converts in small blocks, without a full-length temporary array
+        np.divide(samples[:, 0], 32768.0, out=audio[: len(samples)], dtype=np.float32)
+    return audio
+
+
+def _extension(file: str) -> str:
+    return os.path.splitext(file)[1].lower() if isinstance(file, str) else ""
+
+
+def decode_audio_wave(file: str, sr: int, padding: int = 0) -> Optional[np.ndarray]:
+    """Decode 16-bit PCM WAV files at the given sample rate, using the `wave` module"""
+    if _extension(file) != ".wav":
+        return None
+
+    try:
+        with wave.open(file, "rb") as f:
+            if f.getsampwidth() != 2 or f.getframerate() != sr:
+                return None
+            n_channels = f.getnchannels()
+            data = f.readframes(f.getnframes())
+    except (wave.Error, EOFError):
+        return None  # not a PCM WAV file, e.g. WAVE_FORMAT_EXTENSIBLE
+
+    return _int16_to_mono(np.frombuffer(data, "<i2"), n_channels, padding)
+
+
+def decode_audio_soundfile(
+    file: str, sr: int, padding: int = 0
+) -> Optional[np.ndarray]:
+    """Decode WAV, FLAC and OGG files at the given sample rate, using libsndfile"""
+    if soundfile is None or _extension(file) not in {".wav", ".flac", ".ogg", ".oga"}:
+        return None
+
+    try:
+        with soundfile.SoundFile(file) as f:
+            if f.samplerate != sr:
+                return None
+            if f.subtype == "PCM_16":
+                return _int16_to_mono(f.read(dtype="int16"), f.channels, padding)
+            # reading others as int16 would wrap around the overshoots of lossy codecs
+            if f.channels == 1:
+                audio = np.zeros(f.frames + padding, dtype=np.float32)
+                length = len(f.read(dtype="float32", out=audio[: f.frames]))
+            else:
+                data = f.read(dtype="float32", always_2d=True)
+                audio = np.zeros(len(data) + padding, dtype=np.float32)
+                length = len(
+                    data.mean(axis=1, dtype=np.float32, out=audio[: len(data)])
+                )
+    except (RuntimeError, TypeError):
+        return None  # raised by libsndfile for unsupported or malformed files
+
+    np.clip(audio[:length], -1.0, 32767 / 32768, out=audio[:length])
+    return audio[: length + padding]
+
+
+def decode_audio_raw(file: str, sr: int, padding: int = 0) -> Optional[np.ndarray]:
+    """Read headerless .pcm or .raw files, assumed to be mono 16-bit little-endian at `sr` Hz"""
+    if _extension(file) not in {".pcm", ".raw"}:
+        return None
+
+    return _int16_to_mono(np.fromfile(file, "<i2"), 1, padding)
+
+
+# the decoders that `load_audio()` tries in order; each returns None if it cannot decode the file
+AUDIO_DECODERS: Dict[str, Callable[..., Optional[np.ndarray]]] = {
+    "wave": decode_audio_wave,
+    "soundfile": decode_audio_soundfile,
+    "raw": decode_audio_raw,
+    "ffmpeg": decode_audio_ffmpeg,
+}
+
+
+def register_audio_decoder(name: str, decoder: Callable[..., Optional[np.ndarray]]):
+    """
+    Register an in-process decoder for `load_audio()`, to be tried before the ffmpeg CLI.
+    The decoder is called with the file, the sample rate and the `padding` keyword argument,
+    and should return the mono float32 waveform at that sample rate followed by `padding`
+    zero samples, or None if it doesn't support the file.
+    """
+    ffmpeg = AUDIO_DECODERS.pop("ffmpeg")
+    AUDIO_DECODERS[name] = decoder
+    AUDIO_DECODERS["ffmpeg"] = ffmpeg
+
+
+def stream_audio(
+    file: str, sr: int = SAMPLE_RATE, chunk_size: int = N_SAMPLES
+) -> Iterator[np.ndarray]:
+    """
+    Open an audio file and read it as mono waveform in chunks, resampling as necessary
+
+    Parameters
+    ----------
+    file: str
+        The audio file to open
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    chunk_size: int
+        The number of samples in each chunk; the last chunk may be shorter
+
+    Returns
+    -------
+    An iterator of NumPy arrays containing the audio waveform, in float32 dtype.
+    """
+
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", file,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+
+    # ffmpeg's log is written to a temporary file, so that it can't fill up the pipe
+    # and block the process while we are only reading from stdout.
+    with tempfile.TemporaryFile() as stderr:
+        process = Popen(cmd, stdout=PIPE, stderr=stderr)
+        try:
+            while chunk := process.stdout.read(chunk_size * 2):
+                yield np.frombuffer(chunk, np.int16).astype(np.float32) / 32768.0
+        except GeneratorExit:
+            process.kill()  # the caller stopped reading before the end of the audio
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
 
 
 def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
     """
     Pad or trim the audio array to N_SAMPLES, as expected by the encoder.
+    A trimmed array is returned as a view of the input, without copying.
     """
     if torch.is_tensor(array):
         if array.shape[axis] > length:
-            array = array.index_select(
-                dim=axis, index=torch.arange(length, device=array.device)
-            )
+            array = array.narrow(axis, 0, length)
 
         if array.shape[axis] < length:
             pad_widths = [(0, 0)] * array.ndim
@@ -78,7 +269,9 @@ def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
             array = F.pad(array, [pad for sizes in pad_widths[::-1] for pad in sizes])
     else:
         if array.shape[axis] > length:
-            array = array.take(indices=range(length), axis=axis)
+            index = [slice(None)] * array.ndim
+            index[axis] = slice(length)
+            array = array[tuple(index)]
 
         if array.shape[axis] < length:
             pad_widths = [(0, 0)] * array.ndim
@@ -88,6 +281,150 @@ def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
     return array
 
 
+@lru_cache(maxsize=None)
+def resample_filters(
+    device, orig: int, new: int, lowpass_filter_width: int = 6, rolloff: float = 0.99
+) -> torch.Tensor:
+    """
+    The polyphase filter bank for resampling by the reduced ratio `new / orig`, i.e. a
+    Hann-windowed sinc lowpass filter for each of the `new` output phases, which are applied to
+    the input with a stride of `orig` samples. The cutoff is `rolloff` times the lower Nyquist
+    frequency, and each filter spans `lowpass_filter_width` zero crossings on either side.
+
+    Returns
+    -------
+    torch.Tensor, shape = (new, 1, 2 * width + orig)
+        The filters, where `width` is the number of input samples before the first one used by
+        each block of `new` output samples
+    """
+    base_freq = min(orig, new) * rolloff
+    width = math.ceil(lowpass_filter_width * orig / base_freq)
+
+    # the time of each input sample relative to each output sample, in input periods
+    idx = torch.arange(-width, width + orig, dtype=torch.float64) / orig
+    t = (idx[None] - torch.arange(new, dtype=torch.float64)[:, None] / new) * base_freq
+    t = t.clamp(-lowpass_filter_width, lowpass_filter_width)
+
+    window = torch.cos(t * math.pi / lowpass_filter_width / 2) ** 2
+    sinc = torch.where(t == 0, 1.0, torch.sin(t * math.pi) / (t * math.pi))
+    filters = sinc * window * base_freq / orig
+    return filters[:, None].float().to(device)
+
+
+def _resample_ratio(orig_sr: int, target_sr: int) -> Tuple[int, int]:
+    gcd = math.gcd(orig_sr, target_sr)
+    return orig_sr // gcd, target_sr // gcd
+
+
+def _resample_blocks(audio: torch.Tensor, orig: int, new: int) -> torch.Tensor:
+    """Apply the polyphase filters to every complete block of `orig` input samples"""
+    filters = resample_filters(audio.device, orig, new)
+    out = F.conv1d(audio.reshape(-1, 1, audio.shape[-1]), filters, stride=orig)
+    return out.transpose(1, 2).reshape(*audio.shape[:-1], -1)
+
+
+def resample(
+    audio: Union[np.ndarray, torch.Tensor],
+    orig_sr: int,
+    target_sr: int = SAMPLE_RATE,
+) -> Union[np.ndarray, torch.Tensor]:
+    """
+    Resample the waveform with a polyphase windowed-sinc filter, e.g. from the 44.1 or 48 kHz of
+    sound cards to the 16 kHz that the model expects, without a round trip through ffmpeg
+
+    Parameters
+    ----------
+    audio: Union[np.ndarray, torch.Tensor], shape = (*, n_samples)
+        The NumPy array or Tensor containing the audio waveform, at `orig_sr` Hz
+
+    orig_sr: int
+        The sample rate of `audio`
+
+    target_sr: int
+        The sample rate to resample to
+
+    Returns
+    -------
+    The resampled waveform, as a NumPy array or a Tensor like `audio`, with
+    `ceil(n_samples * target_sr / orig_sr)` samples
+    """
+    orig, new = _resample_ratio(orig_sr, target_sr)
+    if orig == new:
+        return audio
+
+    is_numpy = not torch.is_tensor(audio)
+    if is_numpy:
+        audio = torch.from_numpy(np.asarray(audio, dtype=np.float32))
+
+    width = (resample_filters(audio.device, orig, new).shape[-1] - orig) // 2
+    length = audio.shape[-1]
+    out = _resample_blocks(F.pad(audio, (width, width + orig)), orig, new)
+    out = out[..., : math.ceil(length * new / orig)]
+    return out.numpy() if is_numpy else out
+
+
+class Resampler:
+    """
+    Resamples a waveform that arrives in chunks, e.g. from a microphone at its native sample rate,
+    with the same filter as `resample()`. The input samples that the next output samples depend on
+    are carried over between calls, so that concatenating the outputs of `push()` and `flush()`
+    gives the same result as resampling the whole waveform at once.
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int = SAMPLE_RATE):
+        self.orig, self.new = _resample_ratio(orig_sr, target_sr)
+        filters = resample_filters("cpu", self.orig, self.new)
+        self.width = (filters.shape[-1] - self.orig) // 2
+        self.reset()
+
+    def reset(self):
+        """Start a new stream"""
+        self.buffer = np.zeros(self.width, dtype=np.float32)  # the left padding
+        self.num_samples = 0  # the number of input samples pushed so far
+        self.num_outputs = 0  # the number of output samples returned so far
+
+    def push(self, audio: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+        """
+        Add the next samples of the waveform, and return the resampled samples that no longer
+        depend on the samples to come
+        """
+        if torch.is_tensor(audio):
+            audio = audio.cpu().numpy()
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        if self.orig == self.new:
+            return audio
+
+        self.buffer = np.concatenate([self.buffer, audio])
+        self.num_samples += len(audio)
+        return self._emit()
+
+    def flush(self) -> np.ndarray:
+        """Return the remaining samples at the end of the waveform, and start a new stream"""
+        if self.orig == self.new:
+            return np.zeros(0, dtype=np.float32)
+
+        # the right padding, as in `resample()`
+        padding = np.zeros(self.width + self.orig, dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, padding])
+        total = math.ceil(self.num_samples * self.new / self.orig)
+        out = self._emit()[: total - self.num_outputs]
+        self.reset()
+        return out
+
+    def _emit(self) -> np.ndarray:
+        kernel_size = 2 * self.width + self.orig
+        num_blocks = max(0, (len(self.buffer) - kernel_size) // self.orig + 1)
+        if num_blocks == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        used = (num_blocks - 1) * self.orig + kernel_size
+        samples = torch.from_numpy(self.buffer[:used])
+        out = _resample_blocks(samples, self.orig, self.new).numpy()
+        self.buffer = self.buffer[num_blocks * self.orig :]
+        self.num_outputs += len(out)
+        return out
+
+
 @lru_cache(maxsize=None)
 def mel_filters(device, n_mels: int) -> torch.Tensor:
     """
@@ -107,11 +444,77 @@ def mel_filters(device, n_mels: int) -> torch.Tensor:
         return torch.from_numpy(f[f"mel_{n_mels}"]).to(device)
 
 
+def _log_mel_frames(
+    samples: np.ndarray,
+    n_mels: int,
+    device: Optional[Union[str, torch.device]] = None,
+) -> torch.Tensor:
+    """
+    Compute the unnormalized log10-Mel spectrogram of the uncentered STFT frames of `samples`,
+    i.e. one frame for every HOP_LENGTH samples after the first N_FFT samples.
+    """
+    audio = torch.from_numpy(samples)
+    if device is not None:
+        audio = audio.to(device)
+    window = torch.hann_window(N_FFT).to(audio.device)
+    stft = torch.stft(
+        audio, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+    )
+    magnitudes = stft.abs() ** 2
+
+    filters = mel_filters(audio.device, n_mels)
+    mel_spec = filters @ magnitudes
+
+    return torch.clamp(mel_spec, min=1e-10).log10()
+
+
+def _log_mel_blocks(
+    audio: torch.Tensor, n_mels: int, block_frames: int = N_FRAMES
+) -> torch.Tensor:
+    """
+    Compute the unnormalized log10-Mel spectrogram of a 1-D waveform like the centered STFT in
+    `log_mel_spectrogram()`, but `block_frames` frames at a time, so that the complex STFT and the
+    magnitudes are never held in memory for the whole audio. Except at both ends of the audio,
+    where the waveform is reflect-padded, the STFT input is a view of `audio`.
+    """
+    length = audio.shape[-1]
+    num_frames = length // HOP_LENGTH
+    window = torch.hann_window(N_FFT).to(audio.device)
+    filters = mel_filters(audio.device, n_mels)
+
+    log_spec = torch.empty(n_mels, num_frames, device=audio.device)
+    for start in range(0, num_frames, block_frames):
+        end = min(start + block_frames, num_frames)
+        left = start * HOP_LENGTH - N_FFT // 2
+        right = (end - 1) * HOP_LENGTH + N_FFT // 2
+
+        samples = audio[max(left, 0) : min(right, length)]
+        if left < 0 or right > length:
+            head = audio[1 : 1 - left].flip(0) if left < 0 else samples[:0]
+            tail = (
+                audio[2 * length - right - 1 : -1].flip(0)
+                if right > length
+                else samples[:0]
+            )
+            samples = torch.cat([head, samples, tail])
+
+        stft = torch.stft(
+            samples, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+        )
+        magnitudes = stft.abs() ** 2
+        mel_spec = filters @ magnitudes
+        log_spec[:, start:end] = torch.clamp(mel_spec, min=1e-10).log10()
+
+    return log_spec
+
+
 def log_mel_spectrogram(
     audio: Union[str, np.ndarray, torch.Tensor],
     n_mels: int = 80,
     padding: int = 0,
     device: Optional[Union[str, torch.device]] = None,
+    cache: Optional[AudioCache] = None,
+    sample_rate: int = SAMPLE_RATE,
 ):
     """
     Compute the log-Mel spectrogram of
@@ -125,33 +528,409 @@ def log_mel_spectrogram(
         The number of Mel-frequency filters, only 80 and 128 are supported
 
     padding: int
-        Number of zero samples to pad to the right
+        Number of zero samples to pad to the right; when `audio` is a path, the waveform is
+        decoded into a buffer that already includes the padding
 
     device: Optional[Union[str, torch.device]]
         If given, the audio tensor is moved to this device before STFT
 
+    cache: Optional[AudioCache]
+        If given and `audio` is a path, the spectrogram is stored in and loaded from this cache;
+        a cached spectrogram is memory-mapped and only read from disk as it is accessed
+
+    sample_rate: int
+        The sample rate of `audio` if it is a waveform, which is resampled to 16 kHz if necessary;
+        audio files are decoded at 16 kHz and ignore it
+
     Returns
     -------
     torch.Tensor, shape = (n_mels, n_frames)
         A Tensor that contains the Mel spectrogram
     """
+    if cache is not None and isinstance(audio, str):
+        compute = partial(log_mel_spectrogram, audio, n_mels, padding, device)
+        mel = cache.get_or_compute(
+            audio,
+            "mel",
+            lambda: compute().cpu().numpy(),
+            n_mels=n_mels,
+            padding=padding,
+        )
+        mel = torch.from_numpy(mel)
+        return mel if device is None else mel.to(device)
+
     if not torch.is_tensor(audio):
         if isinstance(audio, str):
-            audio = load_audio(audio)
+            audio = load_audio(audio, padding=padding)
+            padding, sample_rate = 0, SAMPLE_RATE  # decoded at 16 kHz by ffmpeg
         audio = torch.from_numpy(audio)
 
     if device is not None:
         audio = audio.to(device)
+    if sample_rate != SAMPLE_RATE:
+        audio = resample(audio, sample_rate)
     if padding > 0:
         audio = F.pad(audio, (0, padding))
-    window = torch.hann_window(N_FFT).to(audio.device)
-    stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
-    magnitudes = stft[..., :-1].abs() ** 2
 
-    filters = mel_filters(audio.device, n_mels)
-    mel_spec = filters @ magnitudes
+    if audio.ndim == 1:
+        log_spec = _log_mel_blocks(audio, n_mels)
+    else:
+        window = torch.hann_window(N_FFT).to(audio.device)
+        stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+
+        filters = mel_filters(audio.device, n_mels)
+        mel_spec = filters @ magnitudes
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
 
-    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
-    log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
-    log_spec = (log_spec + 4.0) / 4.0
+    # normalize in place, as the spectrogram of a long audio can take a lot of memory
+    log_spec = torch.maximum(log_spec, log_spec.max() - 8.0, out=log_spec)
+    log_spec = log_spec.add_(4.0).div_(4.0)
     return log_spec
+
+
+def log_mel_spectrogram_batch(
+    audios: Sequence[Union[np.ndarray, torch.Tensor]],
+    n_mels: int = 80,
+    n_frames: int = N_FRAMES,
+    device: Optional[Union[str, torch.device]] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Compute the log-Mel spectrograms of waveforms of different lengths at once, using a single
+    STFT and filterbank multiplication over the padded batch. The result for each waveform is the
+    same as `pad_or_trim(log_mel_spectrogram(audio), n_frames)`, including the normalization
+    relative to the maximum of each waveform.
+
+    Parameters
+    ----------
+    audios: Sequence[Union[np.ndarray, torch.Tensor]]
+        The NumPy arrays or Tensors containing the audio waveforms in 16 kHz
+
+    n_mels: int
+        The number of Mel-frequency filters, only 80 and 128 are supported
+
+    n_frames: int
+        The number of frames to pad or trim the spectrograms to
+
+    device: Optional[Union[str, torch.device]]
+        If given, the audio tensors are moved to this device before STFT
+
+    Returns
+    -------
+    mel: torch.Tensor, shape = (len(audios), n_mels, n_frames)
+        A Tensor that contains the Mel spectrograms
+
+    lengths: torch.Tensor, shape = (len(audios),)
+        The number of valid frames in each spectrogram, before padding
+    """
+    audios = [
+        audio if torch.is_tensor(audio) else torch.from_numpy(audio) for audio in audios
+    ]
+    if device is None:
+        device = audios[0].device
+    lengths = [audio.shape[-1] for audio in audios]
+    num_frames = [length // HOP_LENGTH for length in lengths]
+
+    # reflect-pad each waveform like the centered STFT does, then zero-pad to the same length
+    pad = N_FFT // 2
+    batch = torch.zeros(len(audios), max(lengths) + 2 * pad, device=device)
+    for i, (audio, length) in enumerate(zip(audios, lengths)):
+        audio = audio.to(device)
+        batch[i, pad : pad + length] = audio
+        batch[i, :pad] = audio[1 : pad + 1].flip(0)
+        batch[i, pad + length : 2 * pad + length] = audio[-pad - 1 : -1].flip(0)
+
+    window = torch.hann_window(N_FFT).to(device)
+    stft = torch.stft(
+        batch, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+    )
+    magnitudes = stft.abs() ** 2
+
+    filters = mel_filters(device, n_mels)
+    mel_spec = filters @ magnitudes
+
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10_()
+    mel = torch.zeros(len(audios), n_mels, n_frames, device=device)
+    for i, frames in enumerate(num_frames):
+        # normalize each spectrogram by the maximum of its own frames; the frames after the
+        # end of each waveform are left as zero, as `pad_or_trim()` would do
+        spec = log_spec[i, :, :frames]
+        spec = torch.maximum(spec, spec.max() - 8.0)
+        mel[i, :, : min(frames, n_frames)] = (spec[:, :n_frames] + 4.0) / 4.0
+
+    return mel, torch.tensor(num_frames).clamp(max=n_frames)
+
+
+class MelWindowReader:
+    """
+    Computes log-Mel spectrogram windows on demand from a stream of audio chunks, such as the
+    one returned by `stream_audio()`. Only the samples that can still be requested are kept in
+    memory, so the memory usage does not grow with the length of the audio.
+
+    The frames are the same as the ones `log_mel_spectrogram()` computes over the whole audio,
+    except that the dynamic range is clamped to 8.0 (i.e. 80 dB) below the maximum of each
+    window, instead of the maximum over the whole audio.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[np.ndarray],
+        n_mels: int = 80,
+        device: Optional[Union[str, torch.device]] = None,
+    ):
+        self.chunks = iter(chunks)
+        self.n_mels = n_mels
+        self.device = device
+        self.eof = False
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_offset = 0  # the sample index of buffer[0]
+        self.head = None  # the first samples, to reflect-pad the beginning of the audio
+
+    @property
+    def num_samples(self) -> int:
+        """The number of samples decoded so far"""
+        return self.buffer_offset + len(self.buffer)
+
+    @property
+    def num_frames(self) -> int:
+        """The number of Mel frames in the audio decoded so far"""
+        return self.num_samples // HOP_LENGTH
+
+    def fill(self, num_frames: int) -> int:
+        """Decode until `num_frames` frames are available or the audio has ended"""
+        required = num_frames * HOP_LENGTH + N_FFT // 2
+        chunks = [self.buffer]
+        available = self.num_samples
+        while not self.eof and available < required:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.eof = True
+                break
+            chunks.append(np.asarray(chunk, dtype=np.float32).reshape(-1))
+            available += len(chunks[-1])
+
+        if len(chunks) > 1:
+            self.buffer = np.concatenate(chunks)
+        if self.head is None and (self.eof or self.num_samples > N_FFT // 2):
+            self.head = self.buffer[: N_FFT // 2 + 1].copy()
+
+        return self.num_frames
+
+    def release(self, frame: int):
+        """Discard the samples that are not needed for windows starting at `frame` or later"""
+        start = frame * HOP_LENGTH - N_FFT // 2 - self.buffer_offset
+        if start > 0:
+            self.buffer = self.buffer[start:].copy()
+            self.buffer_offset += start
+
+    def window(self, start: int, num_frames: int) -> torch.Tensor:
+        """
+        Compute the log-Mel spectrogram of the frames `start` to `start + num_frames`
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, num_frames)
+            A Tensor that contains the Mel spectrogram
+        """
+        self.fill(start + num_frames)
+
+        # the samples covered by the centered STFT frames; zero-padded after the end
+        # of the audio and reflect-padded before the beginning, like `torch.stft`
+        left = start * HOP_LENGTH - N_FFT // 2
+        right = (start + num_frames - 1) * HOP_LENGTH + N_FFT // 2
+        if self.buffer_offset > 0 and left < self.buffer_offset:
+            raise ValueError(f"Frame {start} has already been released")
+
+        samples = np.zeros(right - left, dtype=np.float32)
+        lo, hi = max(left, self.buffer_offset), min(right, self.num_samples)
+        if lo < hi:
+            samples[lo - left : hi - left] = self.buffer[
+                lo - self.buffer_offset : hi - self.buffer_offset
+            ]
+        if left < 0 and self.head is not None:
+            reflected = self.head[1 : 1 - left][::-1]
+            samples[-left - len(reflected) : -left] = reflected
+
+        log_spec = _log_mel_frames(samples, self.n_mels, self.device)
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return log_spec
+
+
+class MelWindowPool:
+    """
+    A fixed set of preallocated (n_mels, n_frames) tensors on the model's device and in its dtype,
+    to be filled in place with Mel spectrogram segments instead of allocating new windows with
+    `pad_or_trim()` and `.to()` for every segment. The windows are handed out in turn, so that a
+    window is not overwritten until `size` more segments have been filled. Segments that need
+    neither padding nor conversion are returned as views, without copying.
+    """
+
+    def __init__(
+        self,
+        n_mels: int = 80,
+        n_frames: int = N_FRAMES,
+        device: Optional[Union[str, torch.device]] = None,
+        dtype: torch.dtype = torch.float32,
+        size: int = 2,
+    ):
+        self.windows = [
+            torch.zeros(n_mels, n_frames, device=device, dtype=dtype)
+            for _ in range(size)
+        ]
+        self.lengths = [0] * size  # the number of filled frames in each window
+        self.index = 0
+
+    def fill(self, segment: torch.Tensor) -> torch.Tensor:
+        """
+        Copy the segment into the next window, converting it to the window's device and dtype,
+        and zero-pad or trim it to the window's length like `pad_or_trim()`
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, n_frames)
+            The filled window, which is reused by later calls, or a view of the segment
+        """
+        window, previous = self.windows[self.index], self.lengths[self.index]
+        length = min(segment.shape[-1], window.shape[-1])
+        if (
+            length == window.shape[-1]
+            and segment.device == window.device
+            and segment.dtype == window.dtype
+        ):
+            return segment[:, :length]
+
+        window[:, :length].copy_(segment[:, :length])
+        if length < previous:
+            window[:, length:previous].zero_()  # the rest is still zero from before
+
+        self.lengths[self.index] = length
+        self.index = (self.index + 1) % len(self.windows)
+        return window
+
+
+class StreamingMelFrontend:
+    """
+    Computes the log-Mel spectrogram incrementally while the audio arrives, e.g. from a
+    microphone. The samples overlapping with the upcoming STFT frames are kept between calls,
+    so that each frame is computed only once, and `push()` returns only the new frames.
+
+    Before clamping, the frames match the ones `log_mel_spectrogram()` computes over the whole
+    audio to within 1e-5. The maximum over the whole audio is not known while streaming, so each
+    frame is instead clamped to 8.0 (i.e. 80 dB) below the maximum over the trailing window of
+    `clamp_frames` frames including itself, or over all preceding frames if `clamp_frames` is
+    None. This floor is never above the one of `log_mel_spectrogram()`, and the two are equal
+    when the loudest frame of the audio is within the trailing window. The default window of 30
+    seconds matches the amount of audio that the model sees at once.
+
+    Audio at other sample rates than 16 kHz, e.g. the native rate of a microphone, is resampled
+    as it arrives if `sample_rate` is given.
+    """
+
+    def __init__(
+        self,
+        n_mels: int = 80,
+        clamp_frames: Optional[int] = N_FRAMES,
+        device: Optional[Union[str, torch.device]] = None,
+        sample_rate: int = SAMPLE_RATE,
+    ):
+        if clamp_frames is not None and clamp_frames < 1:
+            raise ValueError("clamp_frames should be at least 1")
+        self.n_mels = n_mels
+        self.clamp_frames = clamp_frames
+        self.device = device
+        self.resampler = Resampler(sample_rate)
+        self.reset()
+
+    def reset(self):
+        """Start a new stream"""
+        self.resampler.reset()
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_offset = 0  # the sample index of buffer[0]
+        self.head = None  # the first samples, to reflect-pad the beginning of the audio
+        self.num_frames = 0  # the number of frames returned so far
+        # the maximum of each frame in the clamp window
+        self.frame_maxima = torch.zeros(0)
+
+    @property
+    def num_samples(self) -> int:
+        """The number of 16 kHz samples received so far"""
+        return self.buffer_offset + len(self.buffer)
+
+    def push(self, audio: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+        """
+        Add the next samples of the waveform, at the frontend's `sample_rate`
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, n_new_frames)
+            The frames that could be computed from the audio received so far
+        """
+        self._append(self.resampler.push(audio))
+
+        # a centered frame is complete once the samples up to half a window after it arrived
+        end = max(0, (self.num_samples - N_FFT // 2 - 1) // HOP_LENGTH + 1)
+        return self._emit(end)
+
+    def flush(self) -> torch.Tensor:
+        """
+        Return the remaining frames at the end of the audio, reflect-padded like in
+        `log_mel_spectrogram()`, and start a new stream.
+        """
+        self._append(self.resampler.flush())
+        length = self.num_samples
+        if length > N_FFT // 2:
+            tail = self.buffer[-(N_FFT // 2 + 1) : -1][::-1]
+            self.buffer = np.concatenate([self.buffer, tail])
+        mel = self._emit(length // HOP_LENGTH)
+        self.reset()
+        return mel
+
+    def _append(self, audio: np.ndarray):
+        self.buffer = np.concatenate([self.buffer, audio])
+        if self.head is None and self.num_samples > N_FFT // 2:
+            self.head = self.buffer[: N_FFT // 2 + 1].copy()
+
+    def _emit(self, end: int) -> torch.Tensor:
+        start = self.num_frames
+        if end <= start:
+            return torch.zeros(self.n_mels, 0)
+
+        left = start * HOP_LENGTH - N_FFT // 2
+        right = (end - 1) * HOP_LENGTH + N_FFT // 2
+        samples = np.zeros(right - left, dtype=np.float32)
+        lo, hi = max(left, self.buffer_offset), min(
+            right, len(self.buffer) + self.buffer_offset
+        )
+        samples[lo - left : hi - left] = self.buffer[
+            lo - self.buffer_offset : hi - self.buffer_offset
+        ]
+        if left < 0 and self.head is not None:
+            reflected = self.head[1 : 1 - left][::-1]
+            samples[-left - len(reflected) : -left] = reflected
+
+        log_spec = _log_mel_frames(samples, self.n_mels, self.device)
+
+        # the floor of each frame, from the maxima of the frames in its clamp window
+        maxima = torch.cat([self.frame_maxima, log_spec.max(dim=0).values.cpu()])
+        if self.clamp_frames is None:
+            window_maxima = maxima.cummax(dim=0).values
+            self.frame_maxima = window_maxima[-1:]
+        else:
+            padded = F.pad(maxima, (self.clamp_frames - 1, 0), value=-np.inf)
+            window_maxima = F.max_pool1d(padded[None], self.clamp_frames, stride=1)[0]
+            # the maxima of the frames before the next one within its window, none if 1 frame
+            self.frame_maxima = maxima[len(maxima) - (self.clamp_frames - 1) :]
+        floor = window_maxima[-(end - start) :].to(log_spec.device) - 8.0
+
+        log_spec = torch.maximum(log_spec, floor)
+        log_spec = (log_spec + 4.0) / 4.0
+
+        self.num_frames = end
+        discard = end * HOP_LENGTH - N_FFT // 2 - self.buffer_offset
+        if discard > 0:
+            self.buffer = self.buffer[discard:]
+            self.buffer_offset += discard
+
+        return log_spec
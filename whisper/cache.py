@@ -0,0 +1,100 @@
+import hashlib
+import os
+import tempfile
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+
+class AudioCache:
+    """
+    An on-disk cache of decoded waveforms and log-Mel spectrograms, keyed by the content hash of
+    the audio file. The arrays are stored as `.npy` files and returned as memory maps, so that a
+    cache hit skips decoding entirely and only the parts of the array that are read are loaded.
+    When the total size of the cache exceeds `max_size` bytes, the least recently used entries
+    are removed.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_size: int = 10 * 1024**3):
+        if root is None:
+            default = os.path.join(os.path.expanduser("~"), ".cache")
+            root = os.path.join(
+                os.getenv("XDG_CACHE_HOME", default), "whisper", "audio"
+            )
+        os.makedirs(root, exist_ok=True)
+
+        self.root = root
+        self.max_size = max_size
+        self.digests: Dict[Tuple[str, int, int], str] = {}
+
+    def digest(self, file: str) -> str:
+        """Returns the SHA256 digest of the file, reusing it while the file is unchanged"""
+        stat = os.stat(file)
+        key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+        if key not in self.digests:
+            sha256 = hashlib.sha256()
+            with open(file, "rb") as f:
+                while block := f.read(1 << 20):
+                    sha256.update(block)
+            self.digests[key] = sha256.hexdigest()
+        return self.digests[key]
+
+    def path(self, file: str, kind: str, **params) -> str:
+        suffix = "".join(f"-{name}{value}" for name, value in sorted(params.items()))
+        return os.path.join(self.root, f"{self.digest(file)}-{kind}{suffix}.npy")
+
+    def get(self, file: str, kind: str, **params) -> Optional[np.ndarray]:
+        """Returns the cached array as a copy-on-write memory map, or None if not cached"""
+        path = self.path(file, kind, **params)
+        try:
+            array = np.load(path, mmap_mode="c")
+        except (FileNotFoundError, ValueError):
+            return None  # not cached, or a truncated file
+
+        os.utime(path)  # mark as recently used
+        return array
+
+    def put(self, file: str, kind: str, array: np.ndarray, **params) -> np.ndarray:
+        """Stores the array and returns it as a memory map of the cached file"""
+        path = self.path(file, kind, **params)
+
+        # write to a temporary file first, so that other processes never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self.evict(keep=path)
+        return np.load(path, mmap_mode="c")
+
+    def get_or_compute(
+        self, file: str, kind: str, compute: Callable[[], np.ndarray], **params
+    ) -> np.ndarray:
+        array = self.get(file, kind, **params)
+        if array is None:
+            array = self.put(file, kind, compute(), **params)
+        return array
+
+    def evict(self, keep: Optional[str] = None):
+        """Removes the least recently used entries until the cache fits in `max_size`"""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".npy") and entry.path != keep and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total_size += os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total_size -= size
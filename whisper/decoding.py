@@ -7,7 +7,13 @@ import torch.nn.functional as F
 from torch import Tensor
 from torch.distributions import Categorical
 
-from .audio import CHUNK_LENGTH
+from .audio import (
+    CHUNK_LENGTH,
+    N_SAMPLES,
+    load_audio,
+    log_mel_spectrogram_batch,
+    pad_or_trim,
+)
 from .tokenizer import Tokenizer, get_tokenizer
 from .utils import compression_ratio
 
@@ -16,20 +22,31 @@ if TYPE_CHECKING:
 
 
 @torch.no_grad()
-def detect_language(
-    model: "Whisper", mel: Tensor, tokenizer: Tokenizer = None
-) -> Tuple[Tensor, List[dict]]:
+def detect_language_batch(
+    model: "Whisper",
+    audio: Union[Tensor, Sequence[Union[str, np.ndarray, Tensor]]],
+    tokenizer: Tokenizer = None,
+) -> Tuple[Tensor, Tensor]:
     """
-    Detect the spoken language in the audio, and return them as list of strings, along with the ids
-    of the most probable language tokens and the probability distribution over all language tokens.
-    This is performed outside the main decode loop in order to not interfere with kv-caching.
+    Detect the spoken languages of a batch of audio with a single forward pass of the encoder and
+    of the decoder, and return the ids of the most probable language tokens and the probability
+    distributions over the languages as tensors.
+
+    Parameters
+    ----------
+    audio : Union[Tensor, Sequence[Union[str, np.ndarray, Tensor]]]
+        The Mel spectrograms, shape = (n_audio, n_mels, n_frames), or the already-encoded audio
+        features, shape = (n_audio, n_audio_ctx, n_audio_state), or the paths to the audio files or
+        the audio waveforms in 16 kHz, of which the first 30 seconds are used. Both can be of a
+        shorter audio context, so a Mel spectrogram of exactly n_audio_state frames is taken for
+        audio features, and should be padded to another length
 
     Returns
     -------
     language_tokens : Tensor, shape = (n_audio,)
         ids of the most probable language tokens, which appears after the startoftranscript token.
-    language_probs : List[Dict[str, float]], length = n_audio
-        list of dictionaries containing the probability distribution over all languages.
+    language_probs : Tensor, shape = (n_audio, n_languages)
+        the probability of each language, in the order of `tokenizer.all_language_codes`.
     """
     if tokenizer is None:
         tokenizer = get_tokenizer(
@@ -43,31 +60,62 @@ def detect_language(
             "This model doesn't have language tokens so it can't perform lang id"
         )
 
-    single = mel.ndim == 2
-    if single:
-        mel = mel.unsqueeze(0)
+    if not isinstance(audio, Tensor):
+        audio = [load_audio(a) if isinstance(a, str) else a for a in audio]
+        audio = [a[..., :N_SAMPLES] for a in audio]
+        audio, _ = log_mel_spectrogram_batch(
+            audio, model.dims.n_mels, device=model.device
+        )
 
-    # skip encoder forward pass if already-encoded audio features were given
-    if mel.shape[-2:] != (model.dims.n_audio_ctx, model.dims.n_audio_state):
-        mel = model.encoder(mel)
+    # skip encoder forward pass if already-encoded audio features were given, which can be of a
+    # shorter audio context, like the mel spectrograms
+    if audio.shape[-1] != model.dims.n_audio_state:
+        audio = model.encoder(audio)
 
     # forward pass using a single token, startoftranscript
-    n_audio = mel.shape[0]
-    x = torch.tensor([[tokenizer.sot]] * n_audio).to(mel.device)  # [n_audio, 1]
-    logits = model.logits(x, mel)[:, 0]
+    n_audio = audio.shape[0]
+    x = torch.tensor([[tokenizer.sot]] * n_audio).to(audio.device)  # [n_audio, 1]
+    logits = model.logits(x, audio)[:, 0]
 
     # collect detected languages; suppress all non-language tokens
     mask = torch.ones(logits.shape[-1], dtype=torch.bool)
     mask[list(tokenizer.all_language_tokens)] = False
     logits[:, mask] = -np.inf
     language_tokens = logits.argmax(dim=-1)
-    language_token_probs = logits.softmax(dim=-1).cpu()
+    language_probs = logits.softmax(dim=-1)[:, list(tokenizer.all_language_tokens)]
+
+    return language_tokens, language_probs
+
+
+@torch.no_grad()
+def detect_language(
+    model: "Whisper", mel: Tensor, tokenizer: Tokenizer = None
+) -> Tuple[Tensor, List[dict]]:
+    """
+    Detect the spoken language in the audio, and return them as list of strings, along with the ids
+    of the most probable language tokens and the probability distribution over all language tokens.
+    This is performed outside the main decode loop in order to not interfere with kv-caching.
+
+    Returns
+    -------
+    language_tokens : Tensor, shape = (n_audio,)
+        ids of the most probable language tokens, which appears after the startoftranscript token.
+    language_probs : List[Dict[str, float]], length = n_audio
+        list of dictionaries containing the probability distribution over all languages.
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages
+        )
+
+    single = mel.ndim == 2
+    if single:
+        mel = mel.unsqueeze(0)
+
+    language_tokens, probs = detect_language_batch(model, mel, tokenizer)
     language_probs = [
-        {
-            c: language_token_probs[i, j].item()
-            for j, c in zip(tokenizer.all_language_tokens, tokenizer.all_language_codes)
-        }
-        for i in range(n_audio)
+        dict(zip(tokenizer.all_language_codes, item_probs))
+        for item_probs in probs.tolist()
     ]
 
     if single:
@@ -110,8 +158,30 @@ class DecodingOptions:
     without_timestamps: bool = False  # use <|notimestamps|> to sample text tokens only
     max_initial_timestamp: Optional[float] = 1.0
 
+    # number of audio positions (of 20 ms each) to encode, for audio shorter than 30 seconds;
+    # faster, but may be less accurate than the full context the models were trained on
+    audio_ctx: Optional[int] = None
+
+    # stop decoding an audio after the first step, returning no tokens, if its no-speech probability
+    # is above `abort_no_speech_threshold` and the log probability of its most likely first token
+    # is below `abort_logprob_threshold`; saves the decoding of silent audio that is discarded
+    abort_no_speech_threshold: Optional[float] = None
+    abort_logprob_threshold: float = -1.0
+
+    # end a sequence as soon as a phrase of up to 16 tokens is repeated this many times in a row,
+    # at least 3, and mark its result with `repetition_loop`, e.g. to fall back to another
+    # temperature
+    max_repetitions: Optional[int] = None
+
     # implementation details
     fp16: bool = True  # use fp16 for most of the calculation
+    # use bf16 for most of the calculation; takes precedence over fp16
+    bf16: bool = False
+    # write the kv cache in place into preallocated buffers
+    static_kv_cache: bool = True
+    # directory of the models exported by `whisper.onnx.export_onnx()`, to run the encoder and
+    # the decoder with ONNX Runtime on CPU instead of PyTorch
+    onnx_model_dir: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -125,11 +195,22 @@ class DecodingResult:
     no_speech_prob: float = np.nan
     temperature: float = np.nan
     compression_ratio: float = np.nan
+    repetition_loop: bool = False
 
 
 class Inference:
-    def logits(self, tokens: Tensor, audio_features: Tensor) -> Tensor:
-        """Perform a forward pass on the decoder and return per-token logits"""
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[Union[Sequence[int], Tensor]] = None,
+        padding: Optional[Tensor] = None,
+    ) -> Tensor:
+        """
+        Perform a forward pass on the decoder and return per-token logits, at the given
+        positions of the tokens of this pass only, if given, for sequences that start with the
+        given numbers of padding tokens, if any
+        """
         raise NotImplementedError
 
     def rearrange_kv_cache(self, source_indices) -> None:
@@ -142,9 +223,15 @@ class Inference:
 
 
 class PyTorchInference(Inference):
-    def __init__(self, model: "Whisper", initial_token_length: int):
+    def __init__(
+        self,
+        model: "Whisper",
+        initial_token_length: int,
+        max_length: Optional[int] = None,
+    ):
         self.model: "Whisper" = model
         self.initial_token_length = initial_token_length
+        self.max_length = max_length  # the length of the static kv cache, if used
         self.kv_cache = {}
         self.hooks = []
 
@@ -152,15 +239,29 @@ class PyTorchInference(Inference):
         value_modules = [block.attn.value for block in self.model.decoder.blocks]
         self.kv_modules = key_modules + value_modules
 
-    def logits(self, tokens: Tensor, audio_features: Tensor) -> Tensor:
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[Union[Sequence[int], Tensor]] = None,
+        padding: Optional[Tensor] = None,
+    ) -> Tensor:
         if not self.kv_cache:
-            self.kv_cache, self.hooks = self.model.install_kv_cache_hooks()
+            self.kv_cache, self.hooks = self.model.install_kv_cache_hooks(
+                max_length=self.max_length
+            )
 
         if tokens.shape[-1] > self.initial_token_length:
             # only need to use the last token except in the first forward pass
             tokens = tokens[:, -1:]
 
-        return self.model.decoder(tokens, audio_features, kv_cache=self.kv_cache)
+        return self.model.decoder(
+            tokens,
+            audio_features,
+            kv_cache=self.kv_cache,
+            positions=positions,
+            padding=padding,
+        )
 
     def cleanup_caching(self):
         for hook in self.hooks:
@@ -171,6 +272,19 @@ class PyTorchInference(Inference):
 
     def rearrange_kv_cache(self, source_indices):
         if source_indices != list(range(len(source_indices))):
+            if self.max_length is not None:
+                # copy only the sequences that are replaced, in place in the static buffers
+                moved = [i for i, source in enumerate(source_indices) if source != i]
+                device = self.kv_cache[self.kv_modules[0]].device
+                targets = torch.tensor(moved, device=device)
+                sources = torch.tensor(
+                    [source_indices[i] for i in moved], device=device
+                )
+                for module in self.kv_modules:
+                    cache = self.kv_cache[module]
+                    cache.index_copy_(0, targets, cache.index_select(0, sources))
+                return
+
             for module in self.kv_modules:
                 # update the key/value cache to contain the selected sequences
                 self.kv_cache[module] = self.kv_cache[module][source_indices].detach()
@@ -311,14 +425,23 @@ class BeamSearchDecoder(TokenDecoder):
         self.inference = inference
         self.patience = patience or 1.0
         self.max_candidates: int = round(beam_size * self.patience)
-        self.finished_sequences = None
+
+        # the finished sequences of each audio, padded with EOT, in the order they are found
+        # (n_audio, max_candidates, length)
+        self.finished_tokens: Optional[Tensor] = None
+        self.finished_lengths: Optional[Tensor] = None  # (n_audio, max_candidates)
+        self.finished_logprobs: Optional[Tensor] = None  # (n_audio, max_candidates)
+        self.n_finished: Optional[Tensor] = None  # (n_audio,)
 
         assert (
             self.max_candidates > 0
         ), f"Invalid beam size ({beam_size}) or patience ({patience})"
 
     def reset(self):
-        self.finished_sequences = None
+        self.finished_tokens = None
+        self.finished_lengths = None
+        self.finished_logprobs = None
+        self.n_finished = None
 
     def update(
         self, tokens: Tensor, logits: Tensor, sum_logprobs: Tensor
@@ -326,65 +449,93 @@ class BeamSearchDecoder(TokenDecoder):
         if tokens.shape[0] % self.beam_size != 0:
             raise ValueError(f"{tokens.shape}[0] % {self.beam_size} != 0")
 
-        n_audio = tokens.shape[0] // self.beam_size
-        if self.finished_sequences is None:  # for the first update
-            self.finished_sequences = [{} for _ in range(n_audio)]
+        n_audio, n_beam = tokens.shape[0] // self.beam_size, self.beam_size
+        if self.finished_tokens is None:  # for the first update
+            shape = (n_audio, self.max_candidates)
+            self.finished_tokens = tokens.new_full((*shape, 0), self.eot)
+            self.finished_lengths = tokens.new_zeros(shape)
+            self.finished_logprobs = sum_logprobs.new_zeros(shape)
+            self.n_finished = tokens.new_zeros(n_audio)
 
+        # STEP 1: calculate the cumulative log probabilities for possible candidates, in the
+        # order of the beams, shaped (n_audio, n_beam * (n_beam + 1))
         logprobs = F.log_softmax(logits.float(), dim=-1)
-        next_tokens, source_indices, finished_sequences = [], [], []
-        for i in range(n_audio):
-            scores, sources, finished = {}, {}, {}
-
-            # STEP 1: calculate the cumulative log probabilities for possible candidates
-            for j in range(self.beam_size):
-                idx = i * self.beam_size + j
-                prefix = tokens[idx].tolist()
-                for logprob, token in zip(*logprobs[idx].topk(self.beam_size + 1)):
-                    new_logprob = (sum_logprobs[idx] + logprob).item()
-                    sequence = tuple(prefix + [token.item()])
-                    scores[sequence] = new_logprob
-                    sources[sequence] = idx
-
-            # STEP 2: rank the candidates and keep the top beam_size sequences for each audio
-            saved = 0
-            for sequence in sorted(scores, key=scores.get, reverse=True):
-                if sequence[-1] == self.eot:
-                    finished[sequence] = scores[sequence]
-                else:
-                    sum_logprobs[len(next_tokens)] = scores[sequence]
-                    next_tokens.append(sequence)
-                    source_indices.append(sources[sequence])
-
-                    saved += 1
-                    if saved == self.beam_size:
-                        break
-
-            finished_sequences.append(finished)
-
-        tokens = torch.tensor(next_tokens, device=tokens.device)
-        self.inference.rearrange_kv_cache(source_indices)
-
-        # add newly finished sequences to self.finished_sequences
-        assert len(self.finished_sequences) == len(finished_sequences)
-        for previously_finished, newly_finished in zip(
-            self.finished_sequences, finished_sequences
-        ):
-            for seq in sorted(newly_finished, key=newly_finished.get, reverse=True):
-                if len(previously_finished) >= self.max_candidates:
-                    break  # the candidate list is full
-                previously_finished[seq] = newly_finished[seq]
+        top_logprobs, top_tokens = logprobs.topk(n_beam + 1)
+        scores = (sum_logprobs[:, None] + top_logprobs).reshape(n_audio, -1)
+        candidates = top_tokens.reshape(n_audio, -1)
+        sources = torch.arange(tokens.shape[0], device=tokens.device)
+        sources = sources.repeat_interleave(n_beam + 1).reshape(n_audio, -1)
+
+        # beams with the same tokens, as in the first update, propose the same sequences; keep
+        # each sequence once, at its first position, with the score and the source of its last
+        prefixes = tokens.reshape(n_audio, n_beam, -1)
+        same = (prefixes[:, :, None] == prefixes[:, None]).all(dim=-1)
+        same = same.repeat_interleave(n_beam + 1, dim=1)
+        same = same.repeat_interleave(n_beam + 1, dim=2)
+        same &= candidates[:, :, None] == candidates[:, None]
+        indices = torch.arange(same.shape[-1], device=tokens.device)
+        keep = same.int().argmax(dim=-1) == indices
+        last = indices[-1] - same.flip(-1).int().argmax(dim=-1)
+        scores, sources = scores.gather(1, last), sources.gather(1, last)
+
+        # STEP 2: rank the candidates and keep the top beam_size sequences for each audio; the
+        # finished sequences ranked below them are discarded
+        scores, order = scores.sort(dim=-1, descending=True, stable=True)
+        keep, candidates, sources = [
+            t.gather(1, order) for t in (keep, candidates, sources)
+        ]
+        finished = keep & (candidates == self.eot)
+        unfinished = keep & (candidates != self.eot)
+        n_unfinished = unfinished.cumsum(dim=-1)
+        saved = unfinished & (n_unfinished <= n_beam)
+        finished &= n_unfinished < n_beam
+
+        sum_logprobs[:] = scores[saved]
+        source_indices = sources[saved]
+        next_tokens = torch.cat(
+            [tokens[source_indices], candidates[saved, None]], dim=-1
+        )
+        self.inference.rearrange_kv_cache(source_indices.tolist())
+
+        # add newly finished sequences to the finished ones, best first, while there is room
+        slots = self.n_finished[:, None] + finished.cumsum(dim=-1) - 1
+        finished &= slots < self.max_candidates
+        audio_indices, slots = finished.nonzero(as_tuple=True)[0], slots[finished]
+        length = next_tokens.shape[-1]
+        self.finished_tokens = F.pad(
+            self.finished_tokens,
+            (0, length - self.finished_tokens.shape[-1]),
+            value=self.eot,
+        )
+        self.finished_tokens[audio_indices, slots] = F.pad(
+            tokens[sources[finished]], (0, 1), value=self.eot
+        )
+        self.finished_lengths[audio_indices, slots] = length
+        self.finished_logprobs[audio_indices, slots] = scores[finished]
+        self.n_finished += finished.sum(dim=-1)
 
         # mark as completed if all audio has enough number of samples
-        completed = all(
-            len(sequences) >= self.max_candidates
-            for sequences in self.finished_sequences
-        )
-        return tokens, completed
+        completed = bool((self.n_finished >= self.max_candidates).all())
+        return next_tokens, completed
 
     def finalize(self, preceding_tokens: Tensor, sum_logprobs: Tensor):
         # collect all finished sequences, including patience, and add unfinished ones if not enough
+        finished_sequences = [{} for _ in range(preceding_tokens.shape[0])]
+        if self.finished_tokens is not None:
+            finished = zip(
+                self.finished_tokens.tolist(),
+                self.finished_lengths.tolist(),
+                self.finished_logprobs.tolist(),
+                self.n_finished.tolist(),
+            )
+            for sequences, (tokens, lengths, logprobs, n) in zip(
+                finished_sequences, finished
+            ):
+                for seq, length, logprob in zip(tokens[:n], lengths, logprobs):
+                    sequences[tuple(seq[:length])] = logprob
+
         sum_logprobs = sum_logprobs.cpu()
-        for i, sequences in enumerate(self.finished_sequences):
+        for i, sequences in enumerate(finished_sequences):
             if (
                 len(sequences) < self.beam_size
             ):  # when not enough sequences are finished
@@ -396,10 +547,10 @@ class BeamSearchDecoder(TokenDecoder):
 
         tokens: List[List[Tensor]] = [
             [torch.tensor(seq) for seq in sequences.keys()]
-            for sequences in self.finished_sequences
+            for sequences in finished_sequences
         ]
         sum_logprobs: List[List[float]] = [
-            list(sequences.values()) for sequences in self.finished_sequences
+            list(sequences.values()) for sequences in finished_sequences
         ]
         return tokens, sum_logprobs
 
@@ -444,16 +595,24 @@ class ApplyTimestampRules(LogitFilter):
         tokenizer: Tokenizer,
         sample_begin: int,
         max_initial_timestamp_index: Optional[int],
+        max_timestamp_index: Optional[int] = None,
     ):
         self.tokenizer = tokenizer
         self.sample_begin = sample_begin
         self.max_initial_timestamp_index = max_initial_timestamp_index
+        # the end of a shorter audio context
+        self.max_timestamp_index = max_timestamp_index
 
     def apply(self, logits: Tensor, tokens: Tensor):
         # suppress <|notimestamps|> which is handled by without_timestamps
         if self.tokenizer.no_timestamps is not None:
             logits[:, self.tokenizer.no_timestamps] = -np.inf
 
+        # suppress the timestamps after the end of the encoded audio
+        if self.max_timestamp_index is not None:
+            last_allowed = self.tokenizer.timestamp_begin + self.max_timestamp_index
+            logits[:, last_allowed + 1 :] = -np.inf
+
         # timestamps have to appear in pairs, except directly before EOT; mask logits accordingly
         for k in range(tokens.shape[0]):
             sampled_tokens = tokens[k, self.sample_begin :]
@@ -505,39 +664,110 @@ class ApplyTimestampRules(LogitFilter):
                 logits[k, : self.tokenizer.timestamp_begin] = -np.inf
 
 
+def ends_in_repetition_loop(
+    tokens: Tensor, timestamp_begin: int, max_repetitions: int, max_ngram: int = 16
+) -> Tensor:
+    """
+    Whether each sequence of tokens ends with a phrase of up to `max_ngram` tokens repeated
+    `max_repetitions` times in a row; the timestamp tokens, which increase during a loop, are
+    considered equal to each other, and a phrase of timestamps only is not counted
+
+    Parameters
+    ----------
+    tokens : Tensor, shape = (n_batch, n_tokens)
+        the sampled tokens of each sequence
+
+    Returns
+    -------
+    Tensor, shape = (n_batch,)
+        True for the sequences in a repetition loop
+    """
+    tokens = tokens.clamp(max=timestamp_begin)
+    looped = torch.zeros(tokens.shape[0], dtype=torch.bool, device=tokens.device)
+    for n in range(1, max_ngram + 1):
+        length = n * max_repetitions
+        if tokens.shape[-1] < length:
+            break
+        span = tokens[:, -length:]
+        repeated = (span[:, n:] == span[:, :-n]).all(dim=-1)
+        # e.g. the consecutive timestamps of a segment boundary
+        timestamps_only = (span[:, -n:] == timestamp_begin).all(dim=-1)
+        looped |= repeated & ~timestamps_only
+    return looped
+
+
+class EndRepetitionLoops(LogitFilter):
+    def __init__(self, tokenizer: Tokenizer, sample_begin: int, max_repetitions: int):
+        self.tokenizer = tokenizer
+        self.sample_begin = sample_begin
+        self.max_repetitions = max_repetitions
+
+    def apply(self, logits: Tensor, tokens: Tensor):
+        # force EOT as soon as the sampled tokens are in a repetition loop
+        looped = ends_in_repetition_loop(
+            tokens[:, self.sample_begin :],
+            self.tokenizer.timestamp_begin,
+            self.max_repetitions,
+        )
+        logits[looped] = -np.inf
+        logits[looped, self.tokenizer.eot] = 0
+
+
 class DecodingTask:
     inference: Inference
     sequence_ranker: SequenceRanker
     decoder: TokenDecoder
     logit_filters: List[LogitFilter]
 
-    def __init__(self, model: "Whisper", options: DecodingOptions):
+    def __init__(
+        self,
+        model: "Whisper",
+        options: Union[DecodingOptions, Sequence[DecodingOptions]],
+    ):
         self.model = model
 
-        language = options.language or "en"
-        tokenizer = get_tokenizer(
-            model.is_multilingual,
-            num_languages=model.num_languages,
-            language=language,
-            task=options.task,
-        )
+        # the options of each audio, if given per audio, which can differ in the language, the
+        # task, the prompt and the prefix only; the other options are shared by the batch
+        if isinstance(options, DecodingOptions):
+            options = [options]
+        self.item_options: List[DecodingOptions] = [
+            self._verify_options(item) for item in options
+        ]
+        options = self._verify_shared_options(self.item_options)
+
+        tokenizer = self._get_tokenizer(options)
         self.tokenizer: Tokenizer = tokenizer
-        self.options: DecodingOptions = self._verify_options(options)
+        self.options: DecodingOptions = options
 
         self.n_group: int = options.beam_size or options.best_of or 1
         self.n_ctx: int = model.dims.n_text_ctx
         self.sample_len: int = options.sample_len or model.dims.n_text_ctx // 2
+        self.audio_ctx: int = options.audio_ctx or model.dims.n_audio_ctx
 
-        self.sot_sequence: Tuple[int] = tokenizer.sot_sequence
-        if self.options.without_timestamps:
-            self.sot_sequence = tokenizer.sot_sequence_including_notimestamps
-
-        self.initial_tokens: Tuple[int] = self._get_initial_tokens()
-        self.sample_begin: int = len(self.initial_tokens)
-        self.sot_index: int = self.initial_tokens.index(tokenizer.sot)
+        # the initial tokens of each audio are left-padded to the same length, so that the
+        # sampled tokens begin at the same index in every sequence
+        self.initial_tokens: List[Tuple[int]] = [
+            self._get_initial_tokens(item) for item in self.item_options
+        ]
+        self.sample_begin: int = max(map(len, self.initial_tokens))
+        self.padding: List[int] = [
+            self.sample_begin - len(tokens) for tokens in self.initial_tokens
+        ]
+        self.sot_indices: List[int] = [
+            padding + tokens.index(tokenizer.sot)
+            for padding, tokens in zip(self.padding, self.initial_tokens)
+        ]
 
         # inference: implements the forward pass through the decoder, including kv caching
-        self.inference = PyTorchInference(model, len(self.initial_tokens))
+        max_length = None
+        if options.static_kv_cache:
+            max_length = min(self.n_ctx, self.sample_begin + self.sample_len)
+        if options.onnx_model_dir is not None:
+            from .onnx import OnnxInference
+
+            self.inference = OnnxInference(options.onnx_model_dir, self.sample_begin)
+        else:
+            self.inference = PyTorchInference(model, self.sample_begin, max_length)
 
         # sequence ranker: implements how to rank a group of sampled sequences
         self.sequence_ranker = MaximumLikelihoodRanker(options.length_penalty)
@@ -565,7 +795,17 @@ class DecodingTask:
                 )
             self.logit_filters.append(
                 ApplyTimestampRules(
-                    tokenizer, self.sample_begin, max_initial_timestamp_index
+                    tokenizer,
+                    self.sample_begin,
+                    max_initial_timestamp_index,
+                    options.audio_ctx,
+                )
+            )
+        if options.max_repetitions is not None:
+            # last, so that no other filter lifts the EOT it forces
+            self.logit_filters.append(
+                EndRepetitionLoops(
+                    tokenizer, self.sample_begin, options.max_repetitions
                 )
             )
 
@@ -581,13 +821,47 @@ class DecodingTask:
             0 <= options.length_penalty <= 1
         ):
             raise ValueError("length_penalty (alpha) should be a value between 0 and 1")
+        if options.audio_ctx is not None and not (
+            0 < options.audio_ctx <= self.model.dims.n_audio_ctx
+        ):
+            raise ValueError(
+                f"audio_ctx should be between 1 and {self.model.dims.n_audio_ctx}"
+            )
+        if options.max_repetitions is not None and options.max_repetitions < 3:
+            # twice in a row is common in speech, e.g. "no, no"
+            raise ValueError("max_repetitions should be at least 3")
 
         return options
 
-    def _get_initial_tokens(self) -> Tuple[int]:
-        tokens = list(self.sot_sequence)
+    def _verify_shared_options(self, options: List[DecodingOptions]) -> DecodingOptions:
+        per_item_fields = dict(
+            language=None, task="transcribe", prompt=None, prefix=None
+        )
+        shared = [replace(item, **per_item_fields) for item in options]
+        if any(item != shared[0] for item in shared):
+            raise ValueError(
+                "The options of a batch can differ only in language, task, prompt and prefix"
+            )
+        if len({item.task == "lang_id" for item in options}) > 1:
+            raise ValueError("lang_id can't be batched with other tasks")
+
+        return options[0]
+
+    def _get_tokenizer(self, options: DecodingOptions) -> Tokenizer:
+        return get_tokenizer(
+            self.model.is_multilingual,
+            num_languages=self.model.num_languages,
+            language=options.language or "en",
+            task=options.task,
+        )
 
-        if prefix := self.options.prefix:
+    def _get_initial_tokens(self, options: DecodingOptions) -> Tuple[int]:
+        tokenizer = self._get_tokenizer(options)
+        tokens = list(tokenizer.sot_sequence)
+        if options.without_timestamps:
+            tokens = list(tokenizer.sot_sequence_including_notimestamps)
+
+        if prefix := options.prefix:
             prefix_tokens = (
                 self.tokenizer.encode(" " + prefix.strip())
                 if isinstance(prefix, str)
@@ -598,7 +872,7 @@ class DecodingTask:
                 prefix_tokens = prefix_tokens[-max_prefix_len:]
             tokens = tokens + prefix_tokens
 
-        if prompt := self.options.prompt:
+        if prompt := options.prompt:
             prompt_tokens = (
                 self.tokenizer.encode(" " + prompt.strip())
                 if isinstance(prompt, str)
@@ -642,54 +916,92 @@ class DecodingTask:
         return tuple(sorted(set(suppress_tokens)))
 
     def _get_audio_features(self, mel: Tensor):
-        if self.options.fp16:
-            mel = mel.half()
+        if self.options.onnx_model_dir is not None:
+            dtype = torch.float32  # the exported models run in float32
+        elif self.options.bf16:
+            dtype = torch.bfloat16
+        else:
+            dtype = torch.float16 if self.options.fp16 else torch.float32
+        mel = mel.to(dtype)
 
-        if mel.shape[-2:] == (
-            self.model.dims.n_audio_ctx,
-            self.model.dims.n_audio_state,
-        ):
+        if mel.shape[-2:] == (self.audio_ctx, self.model.dims.n_audio_state):
             # encoded audio features are given; skip audio encoding
             audio_features = mel
         else:
-            audio_features = self.model.encoder(mel)
+            if self.options.audio_ctx is not None:
+                # the frames of the audio context only, at two frames per position
+                mel = pad_or_trim(mel, 2 * self.audio_ctx)
+            elif mel.shape[-1] != 2 * self.audio_ctx:
+                raise ValueError(
+                    f"mel should have {2 * self.audio_ctx} frames, unless audio_ctx is given"
+                )
+            if self.options.onnx_model_dir is not None:
+                audio_features = self.inference.encode(mel)
+            else:
+                audio_features = self.model.encoder(mel)
 
-        if audio_features.dtype != (
-            torch.float16 if self.options.fp16 else torch.float32
-        ):
+        if audio_features.dtype != dtype:
             return TypeError(
                 f"audio_features has an incorrect dtype: {audio_features.dtype}"
             )
 
         return audio_features
 
-    def _detect_language(self, audio_features: Tensor, tokens: Tensor):
-        languages = [self.options.language] * audio_features.shape[0]
-        lang_probs = None
-
-        if self.options.language is None or self.options.task == "lang_id":
-            lang_tokens, lang_probs = self.model.detect_language(
-                audio_features, self.tokenizer
+    def _detect_language(
+        self, audio_features: Tensor, tokens: Tensor, sot_indices: List[int]
+    ):
+        n_audio = audio_features.shape[0]
+        languages = [item.language for item in self.item_options]
+        languages = languages * (n_audio // len(languages))
+        lang_probs = [None] * n_audio
+
+        detected = [
+            i
+            for i, language in enumerate(languages)
+            if language is None or self.options.task == "lang_id"
+        ]
+        if detected:
+            lang_tokens, probs = self.model.detect_language(
+                audio_features[detected], self.tokenizer
             )
-            languages = [max(probs, key=probs.get) for probs in lang_probs]
-            if self.options.language is None:
-                tokens[:, self.sot_index + 1] = lang_tokens  # write language tokens
+            for i, lang_token, item_probs in zip(detected, lang_tokens, probs):
+                if languages[i] is None:
+                    tokens[i, sot_indices[i] + 1] = lang_token  # write language tokens
+                languages[i] = max(item_probs, key=item_probs.get)
+                lang_probs[i] = item_probs
 
         return languages, lang_probs
 
-    def _main_loop(self, audio_features: Tensor, tokens: Tensor):
+    def _main_loop(
+        self,
+        audio_features: Tensor,
+        tokens: Tensor,
+        padding: Optional[Tensor] = None,
+        sot_indices: Optional[Tensor] = None,
+    ):
         n_batch = tokens.shape[0]
         sum_logprobs: Tensor = torch.zeros(n_batch, device=audio_features.device)
         no_speech_probs = [np.nan] * n_batch
+        aborted_logprobs: List[Optional[float]] = [None] * n_batch
 
         try:
             for i in range(self.sample_len):
-                logits = self.inference.logits(tokens, audio_features)
+                # project only the positions whose logits are used onto the vocabulary, at the
+                # startoftranscript token of each sequence when it differs between them
+                save_no_speech_probs = i == 0 and self.tokenizer.no_speech is not None
+                if not save_no_speech_probs:
+                    positions = [-1]
+                elif sot_indices is None:
+                    positions = [self.sot_indices[0], -1]
+                else:
+                    last = torch.full_like(sot_indices, tokens.shape[-1] - 1)
+                    positions = torch.stack([sot_indices, last], dim=-1)
+                logits = self.inference.logits(
+                    tokens, audio_features, positions, padding
+                )
 
-                if (
-                    i == 0 and self.tokenizer.no_speech is not None
-                ):  # save no_speech_probs
-                    probs_at_sot = logits[:, self.sot_index].float().softmax(dim=-1)
+                if save_no_speech_probs:
+                    probs_at_sot = logits[:, 0].float().softmax(dim=-1)
                     no_speech_probs = probs_at_sot[:, self.tokenizer.no_speech].tolist()
 
                 # now we need to consider the logits at the last token only
@@ -699,27 +1011,65 @@ class DecodingTask:
                 for logit_filter in self.logit_filters:
                     logit_filter.apply(logits, tokens)
 
+                abort = self.options.abort_no_speech_threshold is not None
+                if save_no_speech_probs and abort:
+                    aborted_logprobs = self._aborted_logprobs(logits, no_speech_probs)
+
                 # expand the tokens tensor with the selected next tokens
                 tokens, completed = self.decoder.update(tokens, logits, sum_logprobs)
 
                 if completed or tokens.shape[-1] > self.n_ctx:
                     break
+                if None not in aborted_logprobs:
+                    break  # the decoding of every audio is aborted
         finally:
             self.inference.cleanup_caching()
 
-        return tokens, sum_logprobs, no_speech_probs
+        return tokens, sum_logprobs, no_speech_probs, aborted_logprobs
+
+    def _aborted_logprobs(
+        self, logits: Tensor, no_speech_probs: List[float]
+    ) -> List[Optional[float]]:
+        """
+        The log probabilities of the most likely first tokens of the sequences whose decoding is
+        aborted by `abort_no_speech_threshold` and `abort_logprob_threshold`, or None
+        """
+        first_logprobs = F.log_softmax(logits.float(), dim=-1).max(dim=-1).values
+        return [
+            (
+                logprob
+                if no_speech_prob > self.options.abort_no_speech_threshold
+                and logprob < self.options.abort_logprob_threshold
+                else None
+            )
+            for logprob, no_speech_prob in zip(first_logprobs.tolist(), no_speech_probs)
+        ]
 
     @torch.no_grad()
     def run(self, mel: Tensor) -> List[DecodingResult]:
         self.decoder.reset()
         tokenizer: Tokenizer = self.tokenizer
         n_audio: int = mel.shape[0]
+        if len(self.item_options) not in (1, n_audio):
+            raise ValueError(
+                f"{len(self.item_options)} options were given for {n_audio} audio"
+            )
 
         audio_features: Tensor = self._get_audio_features(mel)  # encoder forward pass
-        tokens: Tensor = torch.tensor([self.initial_tokens]).repeat(n_audio, 1)
+        repeats = n_audio // len(self.item_options)
+        tokens: Tensor = torch.tensor(
+            [
+                [tokenizer.eot] * padding + list(initial_tokens)
+                for padding, initial_tokens in zip(self.padding, self.initial_tokens)
+            ]
+        ).repeat(repeats, 1)
+        padding = torch.tensor(self.padding * repeats)
+        sot_indices = torch.tensor(self.sot_indices * repeats)
 
         # detect language if requested, overwriting the language token
-        languages, language_probs = self._detect_language(audio_features, tokens)
+        languages, language_probs = self._detect_language(
+            audio_features, tokens, sot_indices.tolist()
+        )
         if self.options.task == "lang_id":
             return [
                 DecodingResult(
@@ -731,24 +1081,37 @@ class DecodingTask:
             ]
 
         # repeat text tensors by the group size, for beam search or best-of-n sampling
-        tokens = tokens.repeat_interleave(self.n_group, dim=0).to(audio_features.device)
+        tokens, padding, sot_indices = [
+            t.repeat_interleave(self.n_group, dim=0).to(audio_features.device)
+            for t in (tokens, padding, sot_indices)
+        ]
 
-        # call the main sampling loop
-        tokens, sum_logprobs, no_speech_probs = self._main_loop(audio_features, tokens)
+        # call the main sampling loop, with the padding and the startoftranscript indices only
+        # when they differ between the sequences
+        tokens, sum_logprobs, no_speech_probs, aborted_logprobs = self._main_loop(
+            audio_features,
+            tokens,
+            padding if max(self.padding) > 0 else None,
+            sot_indices if len(set(self.sot_indices)) > 1 else None,
+        )
 
-        # reshape the tensors to have (n_audio, n_group) as the first two dimensions
-        audio_features = audio_features[:: self.n_group]
+        # reshape the tensors to have (n_audio, n_group) as the first two dimensions;
+        # the audio features are not repeated, as the group shares its cross-attention
         no_speech_probs = no_speech_probs[:: self.n_group]
+        aborted_logprobs = aborted_logprobs[:: self.n_group]
         assert audio_features.shape[0] == len(no_speech_probs) == n_audio
 
         tokens = tokens.reshape(n_audio, self.n_group, -1)
         sum_logprobs = sum_logprobs.reshape(n_audio, self.n_group)
 
-        # get the final candidates for each group, and slice between the first sampled token and EOT
+        # get the final candidates for each group, and slice between the first sampled token and EOT;
+        # the initial tokens are left-padded with EOT
         tokens, sum_logprobs = self.decoder.finalize(tokens, sum_logprobs)
         tokens: List[List[Tensor]] = [
-            [t[self.sample_begin : (t == tokenizer.eot).nonzero()[0, 0]] for t in s]
-            for s in tokens
+            [t[self.sample_begin :] for t in s] for s in tokens
+        ]
+        tokens = [
+            [t[: (t == tokenizer.eot).nonzero()[0, 0]] for t in s] for s in tokens
         ]
 
         # select the top-ranked sample in each group
@@ -761,6 +1124,23 @@ class DecodingTask:
             lp / (len(t) + 1) for t, lp in zip(tokens, sum_logprobs)
         ]
 
+        # the aborted audio have no tokens, and the log probability of their first token
+        for i, logprob in enumerate(aborted_logprobs):
+            if logprob is not None:
+                tokens[i], texts[i], avg_logprobs[i] = [], "", logprob
+
+        # the sequences that were ended in a repetition loop, or that ended in one anyway
+        repetition_loops: List[bool] = [False] * n_audio
+        if self.options.max_repetitions is not None:
+            repetition_loops = [
+                ends_in_repetition_loop(
+                    torch.tensor([t]),
+                    tokenizer.timestamp_begin,
+                    self.options.max_repetitions,
+                ).item()
+                for t in tokens
+            ]
+
         fields = (
             texts,
             languages,
@@ -768,6 +1148,7 @@ class DecodingTask:
             audio_features,
             avg_logprobs,
             no_speech_probs,
+            repetition_loops,
         )
         if len(set(map(len, fields))) != 1:
             raise RuntimeError(f"inconsistent result lengths: {list(map(len, fields))}")
@@ -782,10 +1163,17 @@ class DecodingTask:
                 no_speech_prob=no_speech_prob,
                 temperature=self.options.temperature,
                 compression_ratio=compression_ratio(text),
+                repetition_loop=repetition_loop,
             )
-            for text, language, tokens, features, avg_logprob, no_speech_prob in zip(
-                *fields
-            )
+            for (
+                text,
+                language,
+                tokens,
+                features,
+                avg_logprob,
+                no_speech_prob,
+                repetition_loop,
+            ) in zip(*fields)
         ]
 
 
@@ -793,7 +1181,7 @@ class DecodingTask:
 def decode(
     model: "Whisper",
     mel: Tensor,
-    options: DecodingOptions = DecodingOptions(),
+    options: Union[DecodingOptions, Sequence[DecodingOptions]] = DecodingOptions(),
     **kwargs,
 ) -> Union[DecodingResult, List[DecodingResult]]:
     """
@@ -807,8 +1195,9 @@ def decode(
     mel: torch.Tensor, shape = (80, 3000) or (*, 80, 3000)
         A tensor containing the Mel spectrogram(s)
 
-    options: DecodingOptions
-        A dataclass that contains all necessary options for decoding 30-second segments
+    options: Union[DecodingOptions, Sequence[DecodingOptions]]
+        A dataclass that contains all necessary options for decoding 30-second segments, or one
+        for each Mel spectrogram, which can differ in language, task, prompt and prefix
 
     Returns
     -------
@@ -819,7 +1208,10 @@ def decode(
         mel = mel.unsqueeze(0)
 
     if kwargs:
-        options = replace(options, **kwargs)
+        if isinstance(options, DecodingOptions):
+            options = replace(options, **kwargs)
+        else:
+            options = [replace(item, **kwargs) for item in options]
 
     result = DecodingTask(model, options).run(mel)
 
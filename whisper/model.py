@@ -1,8 +1,9 @@
 import base64
 import gzip
+import warnings
 from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, Iterable, Optional, Tuple
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -11,6 +12,7 @@ from torch import Tensor, nn
 
 from .decoding import decode as decode_function
 from .decoding import detect_language as detect_language_function
+from .decoding import detect_language_batch as detect_language_batch_function
 from .transcribe import transcribe as transcribe_function
 
 try:
@@ -59,6 +61,96 @@ class Conv1d(nn.Conv1d):
         )
 
 
+class QuantizedLinear(nn.Module):
+    """
+    A linear layer with int8 weights, quantized symmetrically per output channel, that quantizes
+    its input dynamically and runs int8 matrix multiplications; only supported on CPU
+    """
+
+    def __init__(self, weight: Tensor, bias: Optional[Tensor] = None):
+        super().__init__()
+        weight = weight.detach().float().cpu()
+        scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+        zero_point = torch.zeros(weight.shape[0], dtype=torch.long)
+        with warnings.catch_warnings():
+            # recent versions deprecate quantized tensors, needed here only to pack the weights
+            warnings.simplefilter("ignore", UserWarning)
+            qweight = torch.quantize_per_channel(
+                weight, scale.double(), zero_point, 0, torch.qint8
+            )
+        bias = None if bias is None else bias.detach().float().cpu()
+
+        self.in_features, self.out_features = weight.shape[1], weight.shape[0]
+        self._packed_params = torch.ops.quantized.linear_prepack(qweight, bias)
+        # avoid the overflow of the 16-bit intermediate sums of fbgemm's int8 kernels
+        self.reduce_range = torch.backends.quantized.engine in {"fbgemm", "x86"}
+
+    def forward(self, x: Tensor) -> Tensor:
+        out = torch.ops.quantized.linear_dynamic(
+            x.float(), self._packed_params, self.reduce_range
+        )
+        return out.to(x.dtype)
+
+
+class QuantizedEmbedding(nn.Module):
+    """
+    The token embedding with int8 weights, quantized symmetrically per token, which also
+    provides the output projection onto the vocabulary that uses the same weights
+    """
+
+    def __init__(self, weight: Tensor):
+        super().__init__()
+        weight = weight.detach().float().cpu()
+        scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127
+        self.register_buffer("weight_int8", torch.round(weight / scale).to(torch.int8))
+        self.register_buffer("scale", scale)
+        self.projection = QuantizedLinear(weight)
+
+    def forward(self, x: Tensor) -> Tensor:
+        return self.weight_int8[x].float() * self.scale[x]
+
+
+def quantize_int8(model: "Whisper") -> "Whisper":
+    """
+    Replace the linear layers of the encoder and the decoder, and the token embedding of the
+    decoder, with their int8 counterparts for dynamically quantized inference on CPU, in place
+    """
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, nn.Linear):
+                setattr(module, name, QuantizedLinear(child.weight, child.bias))
+
+    weight = model.decoder.token_embedding.weight
+    model.decoder.token_embedding = QuantizedEmbedding(weight)
+    return model
+
+
+def to_bfloat16(model: "Whisper") -> "Whisper":
+    """
+    Store the weights of the linear, convolutional and embedding layers in bfloat16, in place;
+    the layer norms and the positional embeddings are kept in float32, as they are upcast anyway
+    """
+    for module in model.modules():
+        if isinstance(module, (Linear, Conv1d, nn.Embedding)):
+            module.to(torch.bfloat16)
+    return model
+
+
+def fuse_projections(model: "Whisper") -> "Whisper":
+    """
+    Replace the attention layers of the encoder and the decoder with `FusedMultiHeadAttention`
+    and their MLPs with `FusedMLP`, in place, using the same weights
+    """
+    for block in [*model.encoder.blocks, *model.decoder.blocks]:
+        block.attn = FusedMultiHeadAttention(block.attn, cross_attention=False)
+        if block.cross_attn is not None:
+            block.cross_attn = FusedMultiHeadAttention(
+                block.cross_attn, cross_attention=True
+            )
+        block.mlp = FusedMLP(block.mlp)
+    return model
+
+
 def sinusoids(length, channels, max_timescale=10000):
     """Returns sinusoids for positional embedding"""
     assert channels % 2 == 0
@@ -115,20 +207,42 @@ class MultiHeadAttention(nn.Module):
         self, q: Tensor, k: Tensor, v: Tensor, mask: Optional[Tensor] = None
     ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
         n_batch, n_ctx, n_state = q.shape
+        n_group = n_batch // k.shape[0]
+        if n_group > 1:
+            # the keys and values are shared by each group of consecutive queries, e.g. the
+            # cross-attention of the beams of the same audio; attend with all their positions at
+            # once instead of repeating the keys and values for each one
+            assert mask is None, "groups of queries are only supported without a mask"
+            q = q.reshape(k.shape[0], n_group * n_ctx, n_state)
+            out, qk = self.qkv_attention(q, k, v)
+            out = out.reshape(n_batch, n_ctx, n_state)
+            if qk is not None:
+                qk = qk.unflatten(2, (n_group, n_ctx)).transpose(1, 2).flatten(0, 1)
+            return out, qk
+
         scale = (n_state // self.n_head) ** -0.25
         q = q.view(*q.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
         k = k.view(*k.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
         v = v.view(*v.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
 
+        # a mask of more than two dimensions is given for each sequence, for the queries and the
+        # keys of this forward pass, e.g. with padding; otherwise it is the causal mask
+        explicit_mask = mask is not None and mask.ndim > 2
+
         if SDPA_AVAILABLE and MultiHeadAttention.use_sdpa:
-            a = scaled_dot_product_attention(
-                q, k, v, is_causal=mask is not None and n_ctx > 1
-            )
+            if explicit_mask:
+                a = scaled_dot_product_attention(q, k, v, attn_mask=mask.to(q.dtype))
+            else:
+                a = scaled_dot_product_attention(
+                    q, k, v, is_causal=mask is not None and n_ctx > 1
+                )
             out = a.permute(0, 2, 1, 3).flatten(start_dim=2)
             qk = None
         else:
             qk = (q * scale) @ (k * scale).transpose(-1, -2)
-            if mask is not None:
+            if explicit_mask:
+                qk = qk + mask
+            elif mask is not None:
                 qk = qk + mask[:n_ctx, :n_ctx]
             qk = qk.float()
 
@@ -139,6 +253,78 @@ class MultiHeadAttention(nn.Module):
         return out, qk
 
 
+def concat_linear(*layers: nn.Linear) -> "Linear":
+    """A linear layer computing the outputs of all the given layers at once"""
+    weight = torch.cat([layer.weight for layer in layers])
+    bias = torch.cat(
+        [
+            (
+                layer.weight.new_zeros(layer.out_features)
+                if layer.bias is None
+                else layer.bias
+            )
+            for layer in layers
+        ]
+    )
+    fused = Linear(weight.shape[1], weight.shape[0], device="meta")
+    fused.weight, fused.bias = nn.Parameter(weight), nn.Parameter(bias)
+    return fused
+
+
+class FusedMultiHeadAttention(MultiHeadAttention):
+    """
+    Computes the query, key and value projections of self-attention, or the key and value
+    projections of cross-attention, with a single matrix multiplication; `key` and `value` are
+    identities on the projected tensors, so that the kv cache hooks are installed as usual
+    """
+
+    def __init__(self, attn: MultiHeadAttention, cross_attention: bool):
+        nn.Module.__init__(self)
+        self.n_head = attn.n_head
+        if cross_attention:
+            self.query = attn.query
+            self.key_value = concat_linear(attn.key, attn.value)
+        else:
+            self.query_key_value = concat_linear(attn.query, attn.key, attn.value)
+        self.key = nn.Identity()
+        self.value = nn.Identity()
+        self.out = attn.out
+
+    def forward(
+        self,
+        x: Tensor,
+        xa: Optional[Tensor] = None,
+        mask: Optional[Tensor] = None,
+        kv_cache: Optional[dict] = None,
+    ):
+        if xa is None:
+            q, k, v = self.query_key_value(x).chunk(3, dim=-1)
+            k, v = self.key(k), self.value(v)
+        else:
+            q = self.query(x)
+            if kv_cache is None or self.key not in kv_cache:
+                # contiguous, as the cached keys and values are reused at every step
+                k, v = [t.contiguous() for t in self.key_value(xa).chunk(2, dim=-1)]
+                k, v = self.key(k), self.value(v)
+            else:
+                k = kv_cache[self.key]
+                v = kv_cache[self.value]
+
+        wv, qk = self.qkv_attention(q, k, v, mask)
+        return self.out(wv), qk
+
+
+class FusedMLP(nn.Module):
+    """The MLP of `ResidualAttentionBlock` in a single module, without `nn.Sequential`"""
+
+    def __init__(self, mlp: nn.Sequential):
+        super().__init__()
+        self.fc1, self.fc2 = mlp[0], mlp[2]
+
+    def forward(self, x: Tensor) -> Tensor:
+        return self.fc2(F.gelu(self.fc1(x)))
+
+
 class ResidualAttentionBlock(nn.Module):
     def __init__(self, n_state: int, n_head: int, cross_attention: bool = False):
         super().__init__()
@@ -187,15 +373,17 @@ class AudioEncoder(nn.Module):
 
     def forward(self, x: Tensor):
         """
-        x : torch.Tensor, shape = (batch_size, n_mels, n_ctx)
+        x : torch.Tensor, shape = (batch_size, n_mels, <= 2 * n_ctx)
             the mel spectrogram of the audio
         """
         x = F.gelu(self.conv1(x))
         x = F.gelu(self.conv2(x))
         x = x.permute(0, 2, 1)
 
-        assert x.shape[1:] == self.positional_embedding.shape, "incorrect audio shape"
-        x = (x + self.positional_embedding).to(x.dtype)
+        # shorter audio, e.g. with `DecodingOptions.audio_ctx`, uses the first positions only
+        n_ctx, n_state = self.positional_embedding.shape
+        assert x.shape[1] <= n_ctx and x.shape[2] == n_state, "incorrect audio shape"
+        x = (x + self.positional_embedding[: x.shape[1]]).to(x.dtype)
 
         for block in self.blocks:
             x = block(x)
@@ -224,27 +412,74 @@ class TextDecoder(nn.Module):
         mask = torch.empty(n_ctx, n_ctx).fill_(-np.inf).triu_(1)
         self.register_buffer("mask", mask, persistent=False)
 
-    def forward(self, x: Tensor, xa: Tensor, kv_cache: Optional[dict] = None):
+        # the token embedding cast to other dtypes for the output projection, by dtype
+        self.cast_embeddings: Dict[torch.dtype, Tuple[tuple, Tensor]] = {}
+
+    def embedding_weight(self, dtype: torch.dtype) -> Tensor:
+        """The token embedding in the given dtype, cast once until the weights are modified"""
+        weight = self.token_embedding.weight
+        if weight.dtype == dtype:
+            return weight
+
+        version = (weight.device, weight.data_ptr(), weight._version)
+        if (
+            dtype not in self.cast_embeddings
+            or self.cast_embeddings[dtype][0] != version
+        ):
+            self.cast_embeddings[dtype] = (version, weight.detach().to(dtype))
+        return self.cast_embeddings[dtype][1]
+
+    def forward(
+        self,
+        x: Tensor,
+        xa: Tensor,
+        kv_cache: Optional[dict] = None,
+        positions: Optional[Union[Sequence[int], Tensor]] = None,
+        padding: Optional[Tensor] = None,
+    ):
         """
         x : torch.LongTensor, shape = (batch_size, <= n_ctx)
             the text tokens
         xa : torch.Tensor, shape = (batch_size, n_audio_ctx, n_audio_state)
             the encoded audio features to be attended on
+        positions : Sequence[int] or torch.LongTensor, shape = (batch_size, n_positions), optional
+            the positions in `x` to compute the logits at, e.g. [-1] for the last token only, or
+            the positions of each sequence; the logits are computed at every position if None
+        padding : torch.LongTensor, shape = (batch_size,), optional
+            the number of padding tokens at the beginning of each sequence, which the other
+            tokens don't attend to and which don't count in the positional embedding
         """
         offset = next(iter(kv_cache.values())).shape[1] if kv_cache else 0
-        x = (
-            self.token_embedding(x)
-            + self.positional_embedding[offset : offset + x.shape[-1]]
-        )
+        n_ctx, mask = x.shape[-1], self.mask
+        if padding is None:
+            x = (
+                self.token_embedding(x)
+                + self.positional_embedding[offset : offset + n_ctx]
+            )
+        else:
+            indices = torch.arange(offset, offset + n_ctx, device=x.device)
+            position_ids = (indices - padding[:, None]).clamp(min=0)
+            x = self.token_embedding(x) + self.positional_embedding[position_ids]
+
+            # the padding tokens attend only to themselves, so that no row is fully masked
+            keys = torch.arange(offset + n_ctx, device=x.device)
+            masked = (keys < padding[:, None, None]) & (keys != indices[:, None])
+            causal = self.mask[offset : offset + n_ctx, : offset + n_ctx]
+            mask = torch.where(masked, -np.inf, causal)[:, None]
         x = x.to(xa.dtype)
 
         for block in self.blocks:
-            x = block(x, xa, mask=self.mask, kv_cache=kv_cache)
+            x = block(x, xa, mask=mask, kv_cache=kv_cache)
 
+        if isinstance(positions, Tensor):
+            x = x[torch.arange(x.shape[0], device=x.device)[:, None], positions]
+        elif positions is not None:
+            x = x[:, positions]
         x = self.ln(x)
-        logits = (
-            x @ torch.transpose(self.token_embedding.weight.to(x.dtype), 0, 1)
-        ).float()
+        if isinstance(self.token_embedding, QuantizedEmbedding):
+            logits = self.token_embedding.projection(x).float()
+        else:
+            logits = (x @ torch.transpose(self.embedding_weight(x.dtype), 0, 1)).float()
 
         return logits
 
@@ -307,13 +542,20 @@ class Whisper(nn.Module):
     def num_languages(self):
         return self.dims.n_vocab - 51765 - int(self.is_multilingual)
 
-    def install_kv_cache_hooks(self, cache: Optional[dict] = None):
+    def install_kv_cache_hooks(
+        self, cache: Optional[dict] = None, max_length: Optional[int] = None
+    ):
         """
         The `MultiHeadAttention` module optionally accepts `kv_cache` which stores the key and value
         tensors calculated for the previous positions. This method returns a dictionary that stores
         all caches, and the necessary hooks for the key and value projection modules that save the
         intermediate tensors to be reused during later calculations.
 
+        If `max_length` is given, the self-attention keys and values are written in place into
+        buffers with room for `max_length` tokens, which are allocated at the first forward pass,
+        and the cache holds views of their filled parts. Otherwise, the cache is concatenated with
+        the new keys and values at every step, which copies the whole cache each time.
+
         Returns
         -------
         cache : Dict[nn.Module, torch.Tensor]
@@ -322,24 +564,49 @@ class Whisper(nn.Module):
             List of PyTorch RemovableHandle objects to stop the hooks to be called
         """
         cache = {**cache} if cache is not None else {}
+        buffers = {}  # the preallocated self-attention caches, if `max_length` is given
         hooks = []
 
+        # the audio context can be shorter than the text context, so cross attention is told
+        # apart by its modules rather than by the length of its keys and values
+        cross_attention_modules = set()
+        for block in self.decoder.blocks:
+            if block.cross_attn is not None:
+                cross_attention_modules.add(block.cross_attn.key)
+                cross_attention_modules.add(block.cross_attn.value)
+
         def save_to_cache(module, _, output):
-            if module not in cache or output.shape[1] > self.dims.n_text_ctx:
+            if module not in cache or module in cross_attention_modules:
                 # save as-is, for the first token or cross attention
                 cache[module] = output
             else:
                 cache[module] = torch.cat([cache[module], output], dim=1).detach()
             return cache[module]
 
+        def save_to_static_cache(module, _, output):
+            if module in cross_attention_modules:
+                cache[module] = output
+                return output
+
+            offset = cache[module].shape[1] if module in cache else 0
+            if module not in buffers:
+                n_batch, _, n_state = output.shape
+                buffers[module] = output.new_empty(n_batch, max_length, n_state)
+            end = offset + output.shape[1]
+            buffers[module][:, offset:end] = output
+            cache[module] = buffers[module][:, :end]
+            return cache[module]
+
         def install_hooks(layer: nn.Module):
             if isinstance(layer, MultiHeadAttention):
-                hooks.append(layer.key.register_forward_hook(save_to_cache))
-                hooks.append(layer.value.register_forward_hook(save_to_cache))
+                hook = save_to_cache if max_length is None else save_to_static_cache
+                hooks.append(layer.key.register_forward_hook(hook))
+                hooks.append(layer.value.register_forward_hook(hook))
 
         self.decoder.apply(install_hooks)
         return cache, hooks
 
     detect_language = detect_language_function
+    detect_language_batch = detect_language_batch_function
     transcribe = transcribe_function
     decode = decode_function
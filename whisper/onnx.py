@@ -0,0 +1,294 @@
+import inspect
+import os
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+from .decoding import Inference
+from .model import (
+    FusedMultiHeadAttention,
+    QuantizedEmbedding,
+    QuantizedLinear,
+    TextDecoder,
+    Whisper,
+)
+
+ENCODER_FILE = "encoder.onnx"
+CROSS_KV_FILE = "cross_kv.onnx"
+DECODER_FILE = "decoder.onnx"
+
+
+def split_heads(x: Tensor, n_head: int) -> Tensor:
+    """Reshape (batch_size, n_ctx, n_state) to (batch_size, n_head, n_ctx, n_state // n_head)"""
+    return x.unflatten(-1, (n_head, -1)).transpose(1, 2)
+
+
+def merge_heads(x: Tensor) -> Tensor:
+    """Reshape (batch_size, n_head, n_ctx, n_state // n_head) to (batch_size, n_ctx, n_state)"""
+    return x.transpose(1, 2).flatten(start_dim=2)
+
+
+class CrossKeyValues(nn.Module):
+    """
+    Computes the keys and the values of the cross-attention of every decoder block, split into
+    the attention heads, once per audio instead of at every decoding step; the keys are scaled
+    and transposed for the product with the queries
+    """
+
+    def __init__(self, decoder: TextDecoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, audio_features: Tensor) -> Tuple[Tensor, ...]:
+        outputs = []
+        for block in self.decoder.blocks:
+            attn = block.cross_attn
+            k = split_heads(attn.key(audio_features), attn.n_head)
+            outputs.append(k.transpose(-1, -2) * k.shape[-1] ** -0.25)
+            outputs.append(split_heads(attn.value(audio_features), attn.n_head))
+        return tuple(outputs)
+
+
+class DecoderStep(nn.Module):
+    """
+    A forward pass of the decoder over the new tokens, given the self-attention keys and values
+    of the previous tokens, shaped (n_layer, 2, batch_size, n_past, n_state), and the
+    cross-attention keys and values of each block from `CrossKeyValues`, whose batch can be
+    smaller by the number of consecutive sequences sharing each audio; returns the logits and
+    the self-attention keys and values including the new tokens
+    """
+
+    def __init__(self, decoder: TextDecoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(
+        self, tokens: Tensor, past_key_values: Tensor, *cross_key_values: Tensor
+    ) -> Tuple[Tensor, Tensor]:
+        decoder = self.decoder
+        offset, n_ctx = past_key_values.shape[3], tokens.shape[1]
+        x = (
+            decoder.token_embedding(tokens)
+            + decoder.positional_embedding[offset : offset + n_ctx]
+        )
+
+        # each new token attends to the previous tokens and itself
+        positions = torch.arange(offset + n_ctx, device=tokens.device)
+        mask = positions[None, :] <= positions[offset:, None]
+
+        present_key_values = []
+        for i, block in enumerate(decoder.blocks):
+            attn, n_head = block.attn, block.attn.n_head
+            h = block.attn_ln(x)
+            k = torch.cat([past_key_values[i, 0], attn.key(h)], dim=1)
+            v = torch.cat([past_key_values[i, 1], attn.value(h)], dim=1)
+            present_key_values.append(torch.stack([k, v]))
+            q, k, v = [split_heads(t, n_head) for t in (attn.query(h), k, v)]
+            out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+            x = x + attn.out(merge_heads(out))
+
+            # the sequences of the same audio share its keys and values; attend with all their
+            # positions at once, as in `MultiHeadAttention.qkv_attention()`
+            attn = block.cross_attn
+            h = block.cross_attn_ln(x)
+            k, v = cross_key_values[2 * i], cross_key_values[2 * i + 1]
+            q = split_heads(attn.query(h).reshape(k.shape[0], -1, x.shape[2]), n_head)
+            w = F.softmax((q * q.shape[-1] ** -0.25) @ k, dim=-1)
+            x = x + attn.out(merge_heads(w @ v).reshape(x.shape))
+
+            x = x + block.mlp(block.mlp_ln(x))
+
+        x = decoder.ln(x)
+        logits = x @ decoder.token_embedding.weight.T
+        return logits.float(), torch.stack(present_key_values)
+
+
+@torch.no_grad()
+def export_onnx(model: Whisper, output_dir: str, opset_version: int = 17) -> str:
+    """
+    Export the encoder, the projection of the audio features to the cross-attention keys and
+    values, and a single step of the decoder with explicit past keys and values, to ONNX
+
+    Parameters
+    ----------
+    model: Whisper
+        The Whisper model instance, in float32, and neither quantized nor fused
+
+    output_dir: str
+        The directory to write "encoder.onnx", "cross_kv.onnx" and "decoder.onnx" in, which can
+        be passed as `DecodingOptions(onnx_model_dir=...)` to decode with ONNX Runtime
+
+    opset_version: int
+        The ONNX opset to export to
+
+    Returns
+    -------
+    The output directory
+    """
+    if any(isinstance(m, FusedMultiHeadAttention) for m in model.modules()):
+        raise ValueError("Fused models can't be exported; export the model as loaded")
+    if any(
+        isinstance(m, (QuantizedLinear, QuantizedEmbedding)) for m in model.modules()
+    ):
+        raise ValueError(
+            "Quantized models can't be exported; export the model as loaded"
+        )
+    if any(p.dtype != torch.float32 for p in model.parameters()):
+        raise ValueError(
+            "Only float32 models can be exported; export the model as loaded"
+        )
+
+    os.makedirs(output_dir, exist_ok=True)
+    dims = model.dims
+    n_layer, n_state = dims.n_text_layer, dims.n_text_state
+    mel = torch.zeros(1, dims.n_mels, 2 * dims.n_audio_ctx)
+    audio_features = torch.zeros(2, dims.n_audio_ctx, dims.n_audio_state)
+    tokens = torch.zeros(6, 3, dtype=torch.long)
+    past_key_values = torch.zeros(n_layer, 2, 6, 4, n_state)
+    cross_key_values = CrossKeyValues(model.decoder)(audio_features)
+    cross_names = [f"cross_{kv}_{i}" for i in range(n_layer) for kv in ("key", "value")]
+    # the keys are transposed, with the audio context last
+    cross_axes = {
+        name: {0: "n_audio", (3 if "key" in name else 2): "n_audio_ctx"}
+        for name in cross_names
+    }
+
+    exports = [
+        (
+            model.encoder,
+            (mel,),
+            ENCODER_FILE,
+            ["mel"],
+            ["audio_features"],
+            {
+                "mel": {0: "batch", 2: "n_frames"},
+                "audio_features": {0: "batch", 1: "n_audio_ctx"},
+            },
+        ),
+        (
+            CrossKeyValues(model.decoder),
+            (audio_features,),
+            CROSS_KV_FILE,
+            ["audio_features"],
+            cross_names,
+            {"audio_features": {0: "n_audio", 1: "n_audio_ctx"}, **cross_axes},
+        ),
+        (
+            DecoderStep(model.decoder),
+            (tokens, past_key_values, *cross_key_values),
+            DECODER_FILE,
+            ["tokens", "past_key_values", *cross_names],
+            ["logits", "present_key_values"],
+            {
+                "tokens": {0: "batch", 1: "n_tokens"},
+                "past_key_values": {2: "batch", 3: "n_past"},
+                "logits": {0: "batch", 1: "n_tokens"},
+                "present_key_values": {2: "batch", 3: "n_total"},
+                **cross_axes,
+            },
+        ),
+    ]
+
+    # the TorchScript-based exporter, which is the default before torch 2.9, supports the
+    # dynamic axes of the traced models directly
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+
+    for module, args, file, input_names, output_names, dynamic_axes in exports:
+        torch.onnx.export(
+            module.eval(),
+            args,
+            os.path.join(output_dir, file),
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            **kwargs,
+        )
+
+    return output_dir
+
+
+@lru_cache(maxsize=None)
+def load_sessions(model_dir: str, num_threads: int = 0):
+    """Create, once per directory, the ONNX Runtime sessions of the models exported there"""
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = num_threads
+    return tuple(
+        onnxruntime.InferenceSession(
+            os.path.join(model_dir, file),
+            session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        for file in (ENCODER_FILE, CROSS_KV_FILE, DECODER_FILE)
+    )
+
+
+class OnnxInference(Inference):
+    """Runs the encoder and the decoder exported by `export_onnx()` with ONNX Runtime on CPU"""
+
+    def __init__(self, model_dir: str, initial_token_length: int):
+        sessions = load_sessions(model_dir, torch.get_num_threads())
+        self.encoder, self.cross_kv, self.decoder = sessions
+        self.initial_token_length = initial_token_length
+        self.cross_key_values: Dict[str, np.ndarray] = {}
+        self.past_key_values: Optional[np.ndarray] = None
+
+    def encode(self, mel: Tensor) -> Tensor:
+        """Encode the log-Mel spectrogram into the audio features"""
+        inputs = {"mel": mel.float().cpu().numpy()}
+        (audio_features,) = self.encoder.run(None, inputs)
+        return torch.from_numpy(audio_features).to(mel.device)
+
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[Union[Sequence[int], Tensor]] = None,
+        padding: Optional[Tensor] = None,
+    ) -> Tensor:
+        if padding is not None:
+            raise ValueError(
+                "The exported decoder doesn't support padding; decode the items with initial "
+                "tokens of different lengths separately"
+            )
+
+        if self.past_key_values is None:
+            inputs = {"audio_features": audio_features.float().cpu().numpy()}
+            names = [output.name for output in self.cross_kv.get_outputs()]
+            self.cross_key_values = dict(zip(names, self.cross_kv.run(None, inputs)))
+            n_layer, n_state = len(names) // 2, audio_features.shape[-1]
+            self.past_key_values = np.zeros(
+                (n_layer, 2, tokens.shape[0], 0, n_state), dtype=np.float32
+            )
+        elif tokens.shape[-1] > self.initial_token_length:
+            # only need to use the last token except in the first forward pass
+            tokens = tokens[:, -1:]
+
+        inputs = {
+            "tokens": tokens.cpu().numpy(),
+            "past_key_values": self.past_key_values,
+        }
+        logits, self.past_key_values = self.decoder.run(
+            None, {**inputs, **self.cross_key_values}
+        )
+        if isinstance(positions, Tensor):
+            logits = np.take_along_axis(logits, positions.cpu().numpy()[..., None], 1)
+        elif positions is not None:
+            logits = logits[:, positions]
+        return torch.from_numpy(logits).to(tokens.device)
+
+    def rearrange_kv_cache(self, source_indices) -> None:
+        if source_indices != list(range(len(source_indices))):
+            self.past_key_values = self.past_key_values[:, :, source_indices]
+
+    def cleanup_caching(self) -> None:
+        self.cross_key_values = {}
+        self.past_key_values = None
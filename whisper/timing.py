@@ -2,7 +2,7 @@ import itertools
 import subprocess
 import warnings
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, List, Optional
 
 import numba
 import numpy as np
@@ -169,7 +169,13 @@ def find_alignment(
     *,
     medfilt_width: int = 7,
     qk_scale: float = 1.0,
+    audio_features: Optional[torch.Tensor] = None,
 ) -> List[WordTiming]:
+    """
+    Align the text tokens to the audio with the cross-attention weights of the alignment heads;
+    if the `audio_features` of `mel` are given, e.g. from the decoding pass, only the decoder is
+    run, instead of encoding `mel` again
+    """
     if len(text_tokens) == 0:
         return []
 
@@ -194,7 +200,9 @@ def find_alignment(
     from .model import disable_sdpa
 
     with torch.no_grad(), disable_sdpa():
-        logits = model(mel.unsqueeze(0), tokens.unsqueeze(0))[0]
+        if audio_features is None:
+            audio_features = model.embed_audio(mel.unsqueeze(0))[0]
+        logits = model.logits(tokens.unsqueeze(0), audio_features.unsqueeze(0))[0]
         sampled_logits = logits[len(tokenizer.sot_sequence) :, : tokenizer.eot]
         token_probs = sampled_logits.softmax(dim=-1)
         text_token_probs = token_probs[np.arange(len(text_tokens)), text_tokens]
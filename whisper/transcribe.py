@@ -1,8 +1,13 @@
 import argparse
+import itertools
 import os
+import sys
 import traceback
 import warnings
-from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -14,9 +19,14 @@ from .audio import (
     N_FRAMES,
     N_SAMPLES,
     SAMPLE_RATE,
+    MelWindowPool,
+    MelWindowReader,
     log_mel_spectrogram,
     pad_or_trim,
+    resample,
+    stream_audio,
 )
+from .cache import AudioCache
 from .decoding import DecodingOptions, DecodingResult
 from .timing import add_word_timestamps
 from .tokenizer import LANGUAGES, TO_LANGUAGE_CODE, get_tokenizer
@@ -52,6 +62,15 @@ def transcribe(
     append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
     clip_timestamps: Union[str, List[float]] = "0",
     hallucination_silence_threshold: Optional[float] = None,
+    streaming: bool = False,
+    audio_cache: Optional[AudioCache] = None,
+    mel: Optional[torch.Tensor] = None,
+    sample_rate: int = SAMPLE_RATE,
+    dynamic_audio_ctx: bool = False,
+    abort_silent_windows: bool = False,
+    batch_size: Optional[int] = None,
+    window_overlap: float = 5.0,
+    count_encoder_calls: bool = False,
     **decode_options,
 ):
     """
@@ -119,12 +138,64 @@ def transcribe(
         When word_timestamps is True, skip silent periods longer than this threshold (in seconds)
         when a possible hallucination is detected
 
+    streaming: bool
+        Decode the audio in chunks and compute the log-Mel spectrogram of each 30-second window
+        only when it is about to be decoded, so that the memory usage does not grow with the
+        length of the audio. The dynamic range of the spectrogram is clamped per window instead
+        of over the whole audio, which may cause small differences in the results.
+
+    audio_cache: Optional[AudioCache]
+        If given and `audio` is a path, the log-Mel spectrogram is stored in and loaded from this
+        on-disk cache, so that transcribing the same file again skips decoding and the STFT.
+
+    mel: Optional[torch.Tensor]
+        The log-Mel spectrogram of the audio padded with 30 seconds of silence, as returned by
+        `log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)`, if it has already
+        been computed, e.g. by `prefetch_mel_spectrograms()`; the audio is then not decoded again.
+
+    sample_rate: int
+        The sample rate of `audio` if it is a waveform, e.g. at the native rate of a sound card;
+        it is resampled to 16 kHz in-process. Audio files are resampled by ffmpeg instead.
+
+    dynamic_audio_ctx: bool
+        Encode only the audio of each window, rounded up to whole seconds, instead of padding it
+        to 30 seconds, with `DecodingOptions.audio_ctx`. This is much faster for short audio, but
+        may be less accurate, since the models were trained on 30-second windows.
+
+    abort_silent_windows: bool
+        Stop decoding a window after the first token if its no-speech probability is above
+        `no_speech_threshold` and the log probability of its most likely first token is below
+        `logprob_threshold`, and skip it like the silent windows whose average log probability is
+        below `logprob_threshold`. This saves the decoding of silent windows, but may skip windows
+        whose full transcription would have had a higher average log probability.
+
+    batch_size: Optional[int]
+        If given, place the 30-second windows up front, at a fixed hop within each clip of
+        `clip_timestamps`, and decode this many of them at a time instead of seeking from one
+        window to the next. This requires `condition_on_previous_text=False`, and the clips can be
+        given at speech boundaries, e.g. from a voice activity detector. The segments in the
+        overlap of two windows are kept from the earlier window if their middle is before the
+        middle of the overlap, and from the later window if their middle is after the end of the
+        segments kept from the earlier window.
+
+    window_overlap: float
+        The overlap of consecutive windows in seconds, between 0 and 15, when `batch_size` is given
+
+    count_encoder_calls: bool
+        Whether to include the number of encoder forward passes for each window in the result,
+        e.g. for benchmarking
+
     Returns
     -------
     A dictionary containing the resulting text ("text") and segment-level details ("segments"), and
-    the spoken language ("language"), which is detected when `decode_options["language"]` is None.
+    the spoken language ("language"), which is detected when `decode_options["language"]` is None,
+    and the number of encoder forward passes for each window ("encoder_calls") if
+    `count_encoder_calls` is True.
     """
-    dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
+    if decode_options.get("bf16", False):
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
     if model.device == torch.device("cpu"):
         if torch.cuda.is_available():
             warnings.warn("Performing inference on CPU when CUDA is available")
@@ -135,11 +206,68 @@ def transcribe(
     if dtype == torch.float32:
         decode_options["fp16"] = False
 
-    # Pad 30-seconds of silence to the input audio, for slicing
-    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
-    content_frames = mel.shape[-1] - N_FRAMES
-    content_duration = float(content_frames * HOP_LENGTH / SAMPLE_RATE)
+    if abort_silent_windows:
+        if no_speech_threshold is None or logprob_threshold is None:
+            raise ValueError(
+                "abort_silent_windows requires no_speech_threshold and logprob_threshold"
+            )
+        # the aborted windows report the log probability of their first token, below the
+        # threshold, as their average log probability, and are skipped like silent windows
+        decode_options["abort_no_speech_threshold"] = no_speech_threshold
+        decode_options["abort_logprob_threshold"] = logprob_threshold
+
+    if batch_size is not None:
+        if batch_size < 1:
+            raise ValueError("batch_size should be at least 1")
+        if condition_on_previous_text:
+            raise ValueError(
+                "batch_size requires condition_on_previous_text=False, since the windows are decoded independently"
+            )
+        if (
+            streaming
+            or dynamic_audio_ctx
+            or hallucination_silence_threshold is not None
+        ):
+            raise ValueError(
+                "batch_size can't be combined with streaming, dynamic_audio_ctx or hallucination_silence_threshold"
+            )
+        if not 0 <= window_overlap <= 15:
+            raise ValueError("window_overlap should be between 0 and 15 seconds")
 
+    if streaming:
+        if isinstance(audio, str):
+            chunks = stream_audio(audio)
+        else:
+            audio = audio.cpu().numpy() if torch.is_tensor(audio) else audio
+            chunks = [resample(audio, sample_rate)]
+        reader = MelWindowReader(chunks, model.dims.n_mels)
+        reader.fill(N_FRAMES)
+    else:
+        # Pad 30-seconds of silence to the input audio, for slicing
+        if mel is None:
+            mel = log_mel_spectrogram(
+                audio,
+                model.dims.n_mels,
+                padding=N_SAMPLES,
+                cache=audio_cache,
+                sample_rate=sample_rate,
+            )
+        content_frames = mel.shape[-1] - N_FRAMES
+
+    # the windows passed to the model, filled in place for each segment
+    window_pool = MelWindowPool(model.dims.n_mels, N_FRAMES, model.device, dtype)
+
+    def get_content_frames(end: int) -> int:
+        # the number of frames in the audio, or at least `end` frames when streaming
+        return reader.fill(end) if streaming else content_frames
+
+    def get_mel_segment(start: int, num_frames: int) -> torch.Tensor:
+        if streaming:
+            return reader.window(start, num_frames)
+        return mel[:, start : start + num_frames]
+
+    # the start, the length and the audio features of the window encoded for language detection
+    language_window: Optional[Tuple[int, int, torch.Tensor]] = None
     if decode_options.get("language", None) is None:
         if not model.is_multilingual:
             decode_options["language"] = "en"
@@ -148,9 +276,25 @@ def transcribe(
                 print(
                     "Detecting language using up to the first 30 seconds. Use `--language` to specify the language"
                 )
-            mel_segment = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
-            _, probs = model.detect_language(mel_segment)
+            if streaming:
+                num_frames = min(N_FRAMES, get_content_frames(N_FRAMES))
+                mel_segment = get_mel_segment(0, num_frames)
+            else:
+                num_frames, mel_segment = N_FRAMES, mel
+            mel_segment = window_pool.fill(mel_segment)
+            with torch.no_grad():
+                audio_features = model.embed_audio(mel_segment.unsqueeze(0))[0]
+            _, probs = model.detect_language(audio_features)
             decode_options["language"] = max(probs, key=probs.get)
+
+            # the first window is decoded from these features if it is the same window, encoded
+            # in the same way
+            if (
+                decode_options.get("audio_ctx") in (None, model.dims.n_audio_ctx)
+                and decode_options.get("onnx_model_dir") is None
+                and not dynamic_audio_ctx
+            ):
+                language_window = (0, num_frames, audio_features)
             if verbose is not None:
                 print(
                     f"Detected language: {LANGUAGES[decode_options['language']].title()}"
@@ -173,7 +317,8 @@ def transcribe(
     if len(seek_points) == 0:
         seek_points.append(0)
     if len(seek_points) % 2 == 1:
-        seek_points.append(content_frames)
+        # when streaming, the length of the audio is unknown until it has been decoded
+        seek_points.append(sys.maxsize if streaming else content_frames)
     seek_clips: List[Tuple[int, int]] = list(zip(seek_points[::2], seek_points[1::2]))
 
     punctuation = "\"'“¿([{-\"'.。,，!！?？:：”)]}、"
@@ -181,48 +326,98 @@ def transcribe(
     if word_timestamps and task == "translate":
         warnings.warn("Word-level timestamps on translations may not be reliable.")
 
+    temperatures = (
+        [temperature] if isinstance(temperature, (int, float)) else temperature
+    )
+
+    def get_decode_kwargs(t: float) -> dict:
+        kwargs = {**decode_options}
+        if t > 0:
+            # disable beam_size and patience when t > 0
+            kwargs.pop("beam_size", None)
+            kwargs.pop("patience", None)
+        else:
+            # disable best_of when t == 0
+            kwargs.pop("best_of", None)
+        return kwargs
+
+    def needs_fallback(decode_result: DecodingResult) -> bool:
+        needs_fallback = False
+        if (
+            compression_ratio_threshold is not None
+            and decode_result.compression_ratio > compression_ratio_threshold
+        ):
+            needs_fallback = True  # too repetitive
+        if decode_result.repetition_loop:
+            needs_fallback = True  # stuck in a repetition loop
+        if (
+            logprob_threshold is not None
+            and decode_result.avg_logprob < logprob_threshold
+        ):
+            needs_fallback = True  # average log probability is too low
+        if (
+            no_speech_threshold is not None
+            and decode_result.no_speech_prob > no_speech_threshold
+            and logprob_threshold is not None
+            and decode_result.avg_logprob < logprob_threshold
+        ):
+            needs_fallback = False  # silence
+        return needs_fallback
+
     def decode_with_fallback(segment: torch.Tensor) -> DecodingResult:
-        temperatures = (
-            [temperature] if isinstance(temperature, (int, float)) else temperature
-        )
         decode_result = None
+        encoder_calls.append(0)
 
         for t in temperatures:
-            kwargs = {**decode_options}
-            if t > 0:
-                # disable beam_size and patience when t > 0
-                kwargs.pop("beam_size", None)
-                kwargs.pop("patience", None)
-            else:
-                # disable best_of when t == 0
-                kwargs.pop("best_of", None)
-
-            options = DecodingOptions(**kwargs, temperature=t)
+            options = DecodingOptions(**get_decode_kwargs(t), temperature=t)
+            if segment.shape[-1] != model.dims.n_audio_state:
+                encoder_calls[-1] += 1
             decode_result = model.decode(segment, options)
 
-            needs_fallback = False
-            if (
-                compression_ratio_threshold is not None
-                and decode_result.compression_ratio > compression_ratio_threshold
-            ):
-                needs_fallback = True  # too repetitive
-            if (
-                logprob_threshold is not None
-                and decode_result.avg_logprob < logprob_threshold
-            ):
-                needs_fallback = True  # average log probability is too low
-            if (
-                no_speech_threshold is not None
-                and decode_result.no_speech_prob > no_speech_threshold
-                and logprob_threshold is not None
-                and decode_result.avg_logprob < logprob_threshold
-            ):
-                needs_fallback = False  # silence
-            if not needs_fallback:
+            # the fallbacks decode the audio features of this attempt instead of encoding the
+            # same window again
+            segment = decode_result.audio_features
+
+            if not needs_fallback(decode_result):
                 break
 
         return decode_result
 
+    def decode_batch_with_fallback(
+        segments: torch.Tensor, prompts: List[List[int]]
+    ) -> List[DecodingResult]:
+        decode_results: List[Optional[DecodingResult]] = [None] * len(segments)
+        first_window = len(encoder_calls)
+        encoder_calls.extend([0] * len(segments))
+
+        pending = list(range(len(segments)))
+        for t in temperatures:
+            kwargs = get_decode_kwargs(t)
+            options = [
+                DecodingOptions(**kwargs, temperature=t, prompt=prompts[i])
+                for i in pending
+            ]
+            if segments.shape[-1] != model.dims.n_audio_state:
+                for i in pending:
+                    encoder_calls[first_window + i] += 1
+            for i, decode_result in zip(pending, model.decode(segments, options)):
+                decode_results[i] = decode_result
+
+            # only the windows that failed are decoded again, from their audio features
+            pending = [i for i in pending if needs_fallback(decode_results[i])]
+            if not pending:
+                break
+            segments = torch.stack([decode_results[i].audio_features for i in pending])
+
+        return decode_results
+
+    def should_skip(result: DecodingResult) -> bool:
+        # no voice activity check
+        if no_speech_threshold is None or result.no_speech_prob <= no_speech_threshold:
+            return False
+        # don't skip if the logprob is high enough, despite the no_speech_prob
+        return logprob_threshold is None or result.avg_logprob <= logprob_threshold
+
     clip_idx = 0
     seek = seek_clips[clip_idx][0]
     input_stride = exact_div(
@@ -233,6 +428,7 @@ def transcribe(
     )  # time per output token: 0.02 (seconds)
     all_tokens = []
     all_segments = []
+    encoder_calls = []  # the number of encoder forward passes for each window
     prompt_reset_since = 0
 
     remaining_prompt_length = model.dims.n_text_ctx // 2 - 1
@@ -260,10 +456,171 @@ def transcribe(
             "no_speech_prob": result.no_speech_prob,
         }
 
+    def add_segments(current_segments: List[dict]):
+        if verbose:
+            for segment in current_segments:
+                start, end, text = segment["start"], segment["end"], segment["text"]
+                line = f"[{format_timestamp(start)} --> {format_timestamp(end)}] {text}"
+                print(make_safe(line))
+
+        # if a segment is instantaneous or does not contain text, clear it
+        for i, segment in enumerate(current_segments):
+            if segment["start"] == segment["end"] or segment["text"].strip() == "":
+                segment["text"] = ""
+                segment["tokens"] = []
+                segment["words"] = []
+
+        all_segments.extend(
+            [
+                {"id": i, **segment}
+                for i, segment in enumerate(current_segments, start=len(all_segments))
+            ]
+        )
+        all_tokens.extend(
+            [token for segment in current_segments for token in segment["tokens"]]
+        )
+
+    def decode_batches(pbar: tqdm.tqdm):
+        nonlocal seek
+        hop = N_FRAMES - round(window_overlap * FRAMES_PER_SECOND)
+
+        # the start and the length of each window, and the middle of its overlap with the next
+        # window, before which the middle of its segments should be
+        windows: List[Tuple[int, int, float]] = []
+        for clip_start, clip_end in seek_clips:
+            clip_end = min(clip_end, content_frames)
+            if clip_start >= clip_end:
+                continue
+            starts = [clip_start]
+            while starts[-1] + N_FRAMES < clip_end:
+                starts.append(starts[-1] + hop)
+            ends = [min(start + N_FRAMES, clip_end) for start in starts]
+            bounds = [
+                (start + end) / 2 / FRAMES_PER_SECOND
+                for start, end in zip(starts[1:], ends[:-1])
+            ]
+            for start, end, bound in zip(starts, ends, [*bounds, np.inf]):
+                windows.append((start, end - start, bound))
+
+        batch_starts = list(range(0, len(windows), batch_size))
+        if (
+            decode_options.get("onnx_model_dir") is not None
+            and initial_prompt_tokens
+            and not carry_initial_prompt
+        ):
+            # the exported decoder can't left-pad the prompts of different lengths of a batch,
+            # so the first window, the only one with the initial prompt, is decoded on its own
+            batch_starts = [0, *range(1, len(windows), batch_size)]
+
+        last_speech_timestamp = 0.0
+        covered_frames = 0
+        for batch_start, batch_end in zip(batch_starts, [*batch_starts[1:], None]):
+            batch = windows[batch_start:batch_end]
+            mel_segments = torch.stack(
+                [
+                    pad_or_trim(mel[:, start : start + size], N_FRAMES)
+                    for start, size, *_ in batch
+                ]
+            ).to(model.device, dtype)
+            # like the sequential loop without conditioning on the previous text
+            prompts = [
+                (
+                    initial_prompt_tokens
+                    if carry_initial_prompt or batch_start + i == 0
+                    else []
+                )
+                for i in range(len(batch))
+            ]
+            results = decode_batch_with_fallback(mel_segments, prompts)
+
+            for (start, size, bound), mel_segment, result in zip(
+                batch, mel_segments, results
+            ):
+                seek = start
+                pbar.update(max(start + size - max(start, covered_frames), 0))
+                covered_frames = start + size
+                if should_skip(result):
+                    continue
+
+                time_offset = float(start * HOP_LENGTH / SAMPLE_RATE)
+                segment_duration = size * HOP_LENGTH / SAMPLE_RATE
+                tokens = torch.tensor(result.tokens)
+                timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+                consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[
+                    0
+                ]
+
+                # the segment left unfinished at the end of the window is kept, since the next
+                # window is not decoded from its start
+                current_segments = []
+                last_slice = 0
+                for current_slice in [*consecutive.add(1).tolist(), len(tokens)]:
+                    sliced_tokens = tokens[last_slice:current_slice]
+                    is_timestamp = timestamp_tokens[last_slice:current_slice]
+                    last_slice = current_slice
+                    if is_timestamp.all():
+                        continue  # no text between the timestamps
+                    start_time, end_time = time_offset, time_offset + segment_duration
+                    if is_timestamp[0]:
+                        start_timestamp_pos = (
+                            sliced_tokens[0].item() - tokenizer.timestamp_begin
+                        )
+                        start_time = time_offset + start_timestamp_pos * time_precision
+                    if is_timestamp[-1]:
+                        end_timestamp_pos = (
+                            sliced_tokens[-1].item() - tokenizer.timestamp_begin
+                        )
+                        end_time = time_offset + end_timestamp_pos * time_precision
+                    current_segments.append(
+                        new_segment(
+                            start=start_time,
+                            end=max(end_time, start_time),
+                            tokens=sliced_tokens,
+                            result=result,
+                        )
+                    )
+
+                if word_timestamps:
+                    add_word_timestamps(
+                        segments=current_segments,
+                        model=model,
+                        tokenizer=tokenizer,
+                        mel=mel_segment,
+                        audio_features=result.audio_features,
+                        num_frames=size,
+                        prepend_punctuations=prepend_punctuations,
+                        append_punctuations=append_punctuations,
+                        last_speech_timestamp=last_speech_timestamp,
+                    )
+
+                # the speech in the overlap of two windows is transcribed by both; a segment is
+                # kept from the earlier window if its middle is before the middle of the overlap,
+                # and from the later window if its middle is after the segments kept until then
+                previous_end = all_segments[-1]["end"] if all_segments else -np.inf
+                current_segments = [
+                    segment
+                    for segment in current_segments
+                    if previous_end <= (segment["start"] + segment["end"]) / 2 < bound
+                ]
+                if word_timestamps:
+                    last_word_end = get_end(current_segments)
+                    if last_word_end is not None:
+                        last_speech_timestamp = last_word_end
+
+                add_segments(current_segments)
+
     # show the progress bar when verbose is False (if True, transcribed text will be printed)
     with tqdm.tqdm(
-        total=content_frames, unit="frames", disable=verbose is not False
+        total=None if streaming else content_frames,
+        unit="frames",
+        disable=verbose is not False,
     ) as pbar:
+        if batch_size is not None:
+            decode_options.pop("prompt", None)
+            decode_batches(pbar)
+            # the windows were placed up front, nothing to seek
+            clip_idx = len(seek_clips)
+
         last_speech_timestamp = 0.0
         # NOTE: This loop is obscurely flattened to make the diff readable.
         # A later commit should turn this into a simpler nested loop.
@@ -273,6 +630,10 @@ def transcribe(
             seek_clip_start, seek_clip_end = seek_clips[clip_idx]
             if seek < seek_clip_start:
                 seek = seek_clip_start
+            content_frames = get_content_frames(seek + N_FRAMES)
+            if streaming:
+                reader.release(seek)
+                seek_clip_end = min(seek_clip_end, content_frames)
             if seek >= seek_clip_end:
                 clip_idx += 1
                 if clip_idx < len(seek_clips):
@@ -281,9 +642,9 @@ def transcribe(
             time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
             window_end_time = float((seek + N_FRAMES) * HOP_LENGTH / SAMPLE_RATE)
             segment_size = min(N_FRAMES, content_frames - seek, seek_clip_end - seek)
-            mel_segment = mel[:, seek : seek + segment_size]
+            mel_segment = get_mel_segment(seek, segment_size)
             segment_duration = segment_size * HOP_LENGTH / SAMPLE_RATE
-            mel_segment = pad_or_trim(mel_segment, N_FRAMES).to(model.device).to(dtype)
+            mel_segment = window_pool.fill(mel_segment)
 
             if carry_initial_prompt:
                 nignored = max(len(initial_prompt_tokens), prompt_reset_since)
@@ -292,22 +653,22 @@ def transcribe(
             else:
                 decode_options["prompt"] = all_tokens[prompt_reset_since:]
 
-            result: DecodingResult = decode_with_fallback(mel_segment)
+            if dynamic_audio_ctx:
+                n_seconds = -(-segment_size // FRAMES_PER_SECOND)
+                audio_ctx = n_seconds * FRAMES_PER_SECOND // input_stride
+                decode_options["audio_ctx"] = min(audio_ctx, model.dims.n_audio_ctx)
+
+            segment = mel_segment
+            if language_window is not None:
+                if language_window[:2] == (seek, segment_size):
+                    segment = language_window[2]
+                language_window = None
+            result: DecodingResult = decode_with_fallback(segment)
             tokens = torch.tensor(result.tokens)
 
-            if no_speech_threshold is not None:
-                # no voice activity check
-                should_skip = result.no_speech_prob > no_speech_threshold
-                if (
-                    logprob_threshold is not None
-                    and result.avg_logprob > logprob_threshold
-                ):
-                    # don't skip if the logprob is high enough, despite the no_speech_prob
-                    should_skip = False
-
-                if should_skip:
-                    seek += segment_size  # fast-forward to the next segment boundary
-                    continue
+            if should_skip(result):
+                seek += segment_size  # fast-forward to the next segment boundary
+                continue
 
             previous_seek = seek
             current_segments = []
@@ -399,11 +760,13 @@ def transcribe(
                 seek += segment_size
 
             if word_timestamps:
+                # the alignment decodes the audio features of the decoding pass
                 add_word_timestamps(
                     segments=current_segments,
                     model=model,
                     tokenizer=tokenizer,
                     mel=mel_segment,
+                    audio_features=result.audio_features,
                     num_frames=segment_size,
                     prepend_punctuations=prepend_punctuations,
                     append_punctuations=append_punctuations,
@@ -465,6 +828,11 @@ def transcribe(
                                     max(time_offset + 1, segment["start"])
                                     * FRAMES_PER_SECOND
                                 )
+                                end_frames = round(
+                                    (segment["end"] + threshold) * FRAMES_PER_SECOND
+                                )
+                                content_frames = get_content_frames(end_frames)
+                                content_duration = content_frames / FRAMES_PER_SECOND
                                 if content_duration - segment["end"] < threshold:
                                     seek = content_frames
                                 current_segments[si:] = []
@@ -475,30 +843,7 @@ def transcribe(
                 if last_word_end is not None:
                     last_speech_timestamp = last_word_end
 
-            if verbose:
-                for segment in current_segments:
-                    start, end, text = segment["start"], segment["end"], segment["text"]
-                    line = f"[{format_timestamp(start)} --> {format_timestamp(end)}] {text}"
-                    print(make_safe(line))
-
-            # if a segment is instantaneous or does not contain text, clear it
-            for i, segment in enumerate(current_segments):
-                if segment["start"] == segment["end"] or segment["text"].strip() == "":
-                    segment["text"] = ""
-                    segment["tokens"] = []
-                    segment["words"] = []
-
-            all_segments.extend(
-                [
-                    {"id": i, **segment}
-                    for i, segment in enumerate(
-                        current_segments, start=len(all_segments)
-                    )
-                ]
-            )
-            all_tokens.extend(
-                [token for segment in current_segments for token in segment["tokens"]]
-            )
+            add_segments(current_segments)
 
             if not condition_on_previous_text or result.temperature > 0.5:
                 # do not feed the prompt tokens if a high temperature was used
@@ -507,11 +852,53 @@ def transcribe(
             # update progress bar
             pbar.update(min(content_frames, seek) - previous_seek)
 
-    return dict(
+        if streaming:
+            pbar.total = pbar.n
+            pbar.refresh()
+
+    result = dict(
         text=tokenizer.decode(all_tokens[len(initial_prompt_tokens) :]),
         segments=all_segments,
         language=language,
     )
+    if count_encoder_calls:
+        result["encoder_calls"] = encoder_calls
+    return result
+
+
+def prefetch_mel_spectrograms(
+    files: Iterable[str],
+    n_mels: int = 80,
+    depth: int = 1,
+    audio_cache: Optional[AudioCache] = None,
+) -> Iterator[Tuple[str, Future]]:
+    """
+    Decode the audio files and compute their padded log-Mel spectrograms in background threads,
+    up to `depth` files ahead of the one that the caller is working on, e.g. transcribing
+
+    Returns
+    -------
+    An iterator of the files and the futures of their spectrograms, to be passed as the `mel`
+    argument of `transcribe()`; the future raises the exception if the file could not be loaded.
+    """
+    compute = partial(
+        log_mel_spectrogram, n_mels=n_mels, padding=N_SAMPLES, cache=audio_cache
+    )
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=max(depth, 1)) as executor:
+        pending = deque()
+        for file in itertools.islice(files, depth + 1):
+            pending.append((file, executor.submit(compute, file)))
+        try:
+            while pending:
+                file, future = pending.popleft()
+                yield file, future
+                # the next file is submitted once the caller is done with this one
+                for file_ahead in itertools.islice(files, 1):
+                    pending.append((file_ahead, executor.submit(compute, file_ahead)))
+        finally:
+            for _, future in pending:
+                future.cancel()  # the caller stopped early, e.g. on KeyboardInterrupt
 
 
 def cli():
@@ -530,6 +917,7 @@ def cli():
     parser.add_argument("--model", default="turbo", type=valid_model_name, help="name of the Whisper model to use")
     parser.add_argument("--model_dir", type=str, default=None, help="the path to save model files; uses ~/.cache/whisper by default")
     parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="quantize the model weights for faster inference on CPU, at a small cost in accuracy")
     parser.add_argument("--output_dir", "-o", type=str, default=".", help="directory to save the outputs")
     parser.add_argument("--output_format", "-f", type=str, default="all", choices=["txt", "vtt", "srt", "tsv", "json", "all"], help="format of the output file; if not specified, all available formats will be produced")
     parser.add_argument("--verbose", type=str2bool, default=True, help="whether to print out the progress and debug messages")
@@ -549,8 +937,12 @@ def cli():
 
     parser.add_argument("--condition_on_previous_text", type=str2bool, default=True, help="if True, provide the previous output of the model as a prompt for the next window; disabling may make the text inconsistent across windows, but the model becomes less prone to getting stuck in a failure loop")
     parser.add_argument("--fp16", type=str2bool, default=True, help="whether to perform inference in fp16; True by default")
+    parser.add_argument("--bf16", type=str2bool, default=False, help="whether to store the weights and perform inference in bf16, e.g. on CPUs that support it; takes precedence over --fp16")
+    parser.add_argument("--onnx_model_dir", type=str, default=None, help="directory of the models exported by whisper.onnx.export_onnx(), to run them with ONNX Runtime on CPU instead of PyTorch")
+    parser.add_argument("--fused", type=str2bool, default=False, help="whether to fuse the query, key and value projections, and the MLP layers, of the model")
 
     parser.add_argument("--temperature_increment_on_fallback", type=optional_float, default=0.2, help="temperature to increase when falling back when the decoding fails to meet either of the thresholds below")
+    parser.add_argument("--max_repetitions", type=optional_int, default=None, help="end the decoding of a window as soon as a phrase of up to 16 tokens is repeated this many times in a row, at least 3, and treat it as failed")
     parser.add_argument("--compression_ratio_threshold", type=optional_float, default=2.4, help="if the gzip compression ratio is higher than this value, treat the decoding as failed")
     parser.add_argument("--logprob_threshold", type=optional_float, default=-1.0, help="if the average log probability is lower than this value, treat the decoding as failed")
     parser.add_argument("--no_speech_threshold", type=optional_float, default=0.6, help="if the probability of the <|nospeech|> token is higher than this value AND the decoding has failed due to `logprob_threshold`, consider the segment as silence")
@@ -564,6 +956,13 @@ def cli():
     parser.add_argument("--threads", type=optional_int, default=0, help="number of threads used by torch for CPU inference; supercedes MKL_NUM_THREADS/OMP_NUM_THREADS")
     parser.add_argument("--clip_timestamps", type=str, default="0", help="comma-separated list start,end,start,end,... timestamps (in seconds) of clips to process, where the last end timestamp defaults to the end of the file")
     parser.add_argument("--hallucination_silence_threshold", type=optional_float, help="(requires --word_timestamps True) skip silent periods longer than this threshold (in seconds) when a possible hallucination is detected")
+    parser.add_argument("--audio_cache_dir", type=str, default=None, help="directory to cache the spectrograms of the audio files in, to skip decoding them when transcribing them again")
+    parser.add_argument("--streaming", type=str2bool, default=False, help="decode the audio in chunks and compute the spectrogram of each 30-second window on demand, to keep the memory usage constant for long audio")
+    parser.add_argument("--prefetch", type=int, default=1, help="number of upcoming audio files to decode and compute the spectrograms of in the background while transcribing; 0 to disable, and not used with --streaming")
+    parser.add_argument("--abort_silent_windows", type=str2bool, default=False, help="stop decoding a window after the first token if its no-speech probability is above --no_speech_threshold and the log probability of the first token is below --logprob_threshold, and skip it")
+    parser.add_argument("--batch_size", type=optional_int, default=None, help="(requires --condition_on_previous_text False) place the windows of each file at a fixed hop and decode this many of them at a time")
+    parser.add_argument("--window_overlap", type=float, default=5.0, help="(requires --batch_size) the overlap of consecutive windows in seconds")
+    parser.add_argument("--dynamic_audio_ctx", type=str2bool, default=False, help="encode only the audio of each window, rounded up to whole seconds, instead of padding it to 30 seconds; much faster for short audio, but may be less accurate")
     # fmt: on
 
     args = parser.parse_args().__dict__
@@ -572,8 +971,13 @@ def cli():
     output_dir: str = args.pop("output_dir")
     output_format: str = args.pop("output_format")
     device: str = args.pop("device")
+    quantize: Optional[str] = args.pop("quantize")
     os.makedirs(output_dir, exist_ok=True)
 
+    if (audio_cache_dir := args.pop("audio_cache_dir")) is not None:
+        args["audio_cache"] = AudioCache(audio_cache_dir)
+    prefetch: int = args.pop("prefetch")
+
     if model_name.endswith(".en") and args["language"] not in {"en", "English"}:
         if args["language"] is not None:
             warnings.warn(
@@ -592,7 +996,14 @@ def cli():
 
     from . import load_model
 
-    model = load_model(model_name, device=device, download_root=model_dir)
+    model = load_model(
+        model_name,
+        device=device,
+        download_root=model_dir,
+        quantize=quantize,
+        bf16=args["bf16"],
+        fused=args.pop("fused"),
+    )
 
     writer = get_writer(output_format, output_dir)
     word_options = [
@@ -610,9 +1021,20 @@ def cli():
     if args["max_words_per_line"] and args["max_line_width"]:
         warnings.warn("--max_words_per_line has no effect with --max_line_width")
     writer_args = {arg: args.pop(arg) for arg in word_options}
-    for audio_path in args.pop("audio"):
+
+    audio_paths = args.pop("audio")
+    if prefetch > 0 and not args["streaming"]:
+        n_mels, audio_cache = model.dims.n_mels, args.pop("audio_cache", None)
+        inputs = prefetch_mel_spectrograms(audio_paths, n_mels, prefetch, audio_cache)
+    else:
+        inputs = ((audio_path, None) for audio_path in audio_paths)
+
+    for audio_path, future in inputs:
         try:
-            result = transcribe(model, audio_path, temperature=temperature, **args)
+            mel = None if future is None else future.result()
+            result = transcribe(
+                model, audio_path, temperature=temperature, mel=mel, **args
+            )
             writer(result, audio_path, **writer_args)
         except Exception as e:
             traceback.print_exc()